@@ -4,20 +4,61 @@
 import os, sys
 import logging
 import click as cli # command line interface
-import pandas as pd
-import sqlalchemy
-from sqlalchemy.pool import NullPool
 import yaml
 from urllib.parse import urlparse
 from urllib.parse import parse_qsl
 import random
-import numpy as np
 import urllib
 import json
-import psutil
+import importlib.util
+import warnings
+import hashlib
+import io
+import zipfile
+import glob
+import tempfile
+import re
+import itertools
+import contextlib
+import shutil
+import copy
+import datetime
+import decimal
+import concurrent.futures
+import functools
+import threading
+import time
+import socket
+import signal
 
 
+class LazyModule:
+    """
+    Module imported on first attribute access, heavy libraries are loaded
+    only by code paths using them to keep cli start fast
+
+    """
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self._name)
+        self.__dict__.update(module.__dict__) # next lookups skip __getattr__
+        return getattr(module, attr)
+
+pd = LazyModule('pandas')
+np = LazyModule('numpy')
+sqlalchemy = LazyModule('sqlalchemy')
+psutil = LazyModule('psutil')
+
 special_sources = ['http://','https://','ftp://','google+sheets', 'microsoft+graph', 'bigquery://']
+engines = {} # sqlalchemy engines shared by jobs in manifest mode
+engines_lock = threading.Lock()
+stdout_lock = threading.Lock() # sys.stdout is replaced for a while by one thread at a time
+keep_engines = False
+serving = False # jobs are run by etl server with warm engines
+job_metrics = threading.local() # metrics of job running in current thread
+collected_metrics = [] # metrics of finished jobs for --metrics-file
 
 def parse_url_params(url):
     result = dict()
@@ -55,20 +96,38 @@ def colnum_string(n):
         string = chr(65 + remainder) + string
     return string
 
-def api_call(method, url, body=None, **kwargs):
-    resource = kwargs.get('resource', None)
-    access_token = kwargs.get('access_token', None)
-    http_headers = {'Authorization':  access_token,
-                    'Accept': 'application/json',
-                    'Content-Type': 'application/json'}
-    endpoint = urllib.parse.urljoin(resource,url.lstrip('/'))
-    logging.debug(f'endpoint: {endpoint}')
-    return method(endpoint, headers=http_headers, json=body)
 
+def google_credentials(credentials_path):
+    """
+    Service account credentials with access token kept on disk,
+    next runs skip authorization while the token is valid
 
-def spreadsheet_open(workbook_ref, credentials_path):
     """
-    Authorize google client and open spreadsheet by title, id, or url
+    service_account = __import__('google.oauth2.service_account', fromlist=['Credentials'])
+    transport = __import__('google.auth.transport.requests', fromlist=['Request'])
+    scopes = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
+    credentials = service_account.Credentials.from_service_account_file(credentials_path, scopes=scopes)
+    key = hashlib.sha256(os.path.abspath(credentials_path).encode('utf-8')).hexdigest()[:16]
+    token_path = os.path.join(cache_dir(), f'google-token-{key}.json')
+    try:
+        with open(token_path, 'r') as token_file:
+            token = json.load(token_file)
+        credentials.token = token['token']
+        credentials.expiry = datetime.datetime.fromisoformat(token['expiry'])
+    except (OSError, ValueError, KeyError):
+        pass
+    if not credentials.valid: # no token or it expires soon
+        credentials.refresh(transport.Request())
+        os.makedirs(cache_dir(), exist_ok=True)
+        with os.fdopen(os.open(token_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as token_file:
+            json.dump({'token': credentials.token, 'expiry': credentials.expiry.isoformat()}, token_file)
+        log.debug(f'google access token saved <{token_path}>')
+    return credentials
+
+@functools.lru_cache(maxsize=None)
+def google_client(credentials_path):
+    """
+    Authorize google client, client is kept for next jobs of the process
 
     """
     pygsheets = __import__('pygsheets')
@@ -80,15 +139,22 @@ def spreadsheet_open(workbook_ref, credentials_path):
         log.error(f'google api key file not found <{credentials_path}>')
         sys.exit(1)
 
-    # To prevent email printing by pygsheets
-    sys.stdout = open(os.devnull, "w")
-    try:
-        gclient = pygsheets.authorize(service_file=credentials_path)
-    except Exception as e:
-        log.error(e)
-        sys.exit(1)
-    # Switch to normal
-    sys.stdout = sys.__stdout__
+    # To prevent email printing by pygsheets, stdout of job is restored after
+    with stdout_lock, open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        try:
+            gclient = pygsheets.authorize(custom_credentials=google_credentials(credentials_path))
+        except Exception as e:
+            log.error(e)
+            sys.exit(1)
+    return gclient
+
+def spreadsheet_open(workbook_ref, credentials_path):
+    """
+    Authorize google client and open spreadsheet by title, id, or url
+
+    """
+    pygsheets = __import__('pygsheets')
+    gclient = google_client(credentials_path)
     try:
         if workbook_ref.startswith(('http://', 'https://')):
             workbook = gclient.open_by_url(workbook_ref)
@@ -111,9 +177,38 @@ def spreadsheet_open(workbook_ref, credentials_path):
         sys.exit(1)
     return workbook
 
-def msgraph_open(credentials_path):
+def gsheet_write(sheet, dataset, block_rows=None, concurrency=4, retries=5):
     """
-    Authorize microsoft graph api client and get token
+    Upload dataframe to google sheet by blocks of rows with values.batchUpdate, blocks are
+    sent at the same time and retried with exponential backoff on quota and server errors
+
+    """
+    discovery = __import__('googleapiclient.discovery', fromlist=['build'])
+    fill = {col: 0 if pd.api.types.is_numeric_dtype(dataset[col]) else '' for col in dataset.columns}
+    rows = [[str(col) for col in dataset.columns]] + dataset.astype(object).fillna(fill).astype(str).values.tolist()
+    block_rows = block_rows or max(1, 200000 // max(1, len(dataset.columns))) # about 200k cells in request
+    sheet.resize(rows=len(rows), cols=max(1, len(dataset.columns)))
+    sheet_title = sheet.title.replace("'", "''")
+    local = threading.local()
+
+    def upload(start):
+        if not hasattr(local, 'service'): # http client of google api is not thread safe
+            local.service = discovery.build('sheets', 'v4', credentials=sheet.client.oauth, cache_discovery=False)
+        body = {
+            'valueInputOption': 'USER_ENTERED',
+            'data': [{'range': f"'{sheet_title}'!A{start + 1}", 'majorDimension': 'ROWS', 'values': rows[start:start + block_rows]}],
+        }
+        local.service.spreadsheets().values().batchUpdate(spreadsheetId=sheet.spreadsheet.id, body=body).execute(num_retries=retries)
+
+    blocks = range(0, len(rows), block_rows)
+    log.debug(f'uploading {len(rows)} rows in {len(blocks)} blocks')
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(upload, blocks))
+
+@functools.lru_cache(maxsize=None)
+def msgraph_app(credentials_path):
+    """
+    Create microsoft graph api client, acquired tokens are cached in client
 
     """
     msal = __import__('msal')
@@ -129,12 +224,20 @@ def msgraph_open(credentials_path):
     with open(credentials_path, 'r') as config_file:
         cfg = yaml.safe_load(config_file)
 
-    # create the MSAL confidential client application and require token
+    # create the MSAL confidential client application
     app = msal.ConfidentialClientApplication(
         client_id = cfg['client_id'], 
         authority=cfg['authority'], 
         client_credential=cfg['client_credential']
         )
+    return app, cfg
+
+def msgraph_open(credentials_path):
+    """
+    Authorize microsoft graph api client and get token
+
+    """
+    app, cfg = msgraph_app(credentials_path)
     token_response = None
     token_response = app.acquire_token_for_client(scopes=cfg['scopes'])
     if token_response.get('error_description'):
@@ -143,6 +246,440 @@ def msgraph_open(credentials_path):
         sys.exit(1)
     return token_response,cfg
 
+def graph_request(session, method, url, retries=5, check=True, **kwargs):
+    """
+    Call graph api, throttled and unavailable requests are repeated after Retry-After
+    or exponential backoff, error responses are raised when check is set
+
+    """
+    requests = __import__('requests')
+    for attempt in itertools.count():
+        try:
+            response = session.request(method, url, **kwargs)
+        except requests.ConnectionError:
+            if attempt >= retries:
+                raise
+            time.sleep(2 ** attempt)
+            continue
+        if response.status_code in (429, 502, 503, 504) and attempt < retries:
+            try:
+                delay = float(response.headers.get('Retry-After'))
+            except (TypeError, ValueError):
+                delay = 2 ** attempt + random.random()
+            log.warning(f'graph api responded {response.status_code}, retry in {delay:.1f}s')
+            time.sleep(delay)
+            continue
+        if check and not response.ok:
+            raise RuntimeError(f'graph api error {response.status_code} on <{url}>: {response.text[:500]}')
+        return response
+
+def graph_session(access_token, concurrency=4):
+    """
+    Http session of graph api keeping connections for requests running at the same time
+
+    """
+    requests = __import__('requests')
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Authorization': access_token,
+                            'Accept': 'application/json',
+                            'Content-Type': 'application/json'})
+    return session
+
+def cell_position(cell):
+    """
+    Column and row numbers of excel cell address like AB12
+
+    """
+    letters = cell.rstrip('0123456789')
+    column = 0
+    for letter in letters.upper():
+        column = column * 26 + ord(letter) - ord('A') + 1
+    return column, int(cell[len(letters):])
+
+def msgraph_pages(workbook_url, sheet_name, resource, access_token, columns=None, rows=None, page_rows=None,
+                  concurrency=4, retries=5, page_cells=200000):
+    """
+    Read used range of excel sheet by graph api in windows of rows fetched at the same time,
+    dataframes of windows are yielded in order, columns and rows limit what is read
+
+    """
+    session = graph_session(access_token, concurrency)
+    workbook = urllib.parse.urljoin(resource, workbook_url.lstrip('/')) + '/workbook'
+    sheet = f'{workbook}/worksheets/{sheet_name}'
+    response = graph_request(session, 'POST', f'{workbook}/createSession', retries, json={'persistChanges': False})
+    session.headers['workbook-session-id'] = response.json()['id']
+
+    def fetch(first_column, last_column, first_row, last_row):
+        address = f'{colnum_string(first_column)}{first_row}:{colnum_string(last_column)}{last_row}'
+        return graph_request(session, 'GET', f"{sheet}/range(address='{address}')?$select=values", retries).json()['values']
+
+    try:
+        used = graph_request(session, 'GET', f'{sheet}/usedRange(valuesOnly=true)?$select=address', retries).json()
+        cells = used['address'].split('!')[-1].split(':')
+        first_column, first_row = cell_position(cells[0])
+        last_column, last_row = cell_position(cells[-1])
+        header = [str(col) for col in fetch(first_column, last_column, first_row, first_row)[0]]
+        if columns: # read only span of needed columns
+            names = [str(col).strip() for col in str(columns).split(',')]
+            missing = [name for name in names if name not in header]
+            if missing:
+                raise ValueError(f'columns {missing} not found on sheet <{sheet_name}>')
+            positions = [header.index(name) for name in names]
+            header = header[min(positions):max(positions) + 1]
+            first_column, last_column = first_column + min(positions), first_column + max(positions)
+        if rows:
+            last_row = min(last_row, first_row + rows)
+        page_rows = page_rows or max(1, page_cells // (last_column - first_column + 1))
+        windows = [(first_column, last_column, row, min(row + page_rows - 1, last_row))
+                   for row in range(first_row + 1, last_row + 1, page_rows)]
+        log.debug(f'reading {last_row - first_row} rows in {len(windows)} pages')
+        if not windows: # only header
+            yield pd.DataFrame(columns=names if columns else header)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            pending = [] # pages read ahead, bounded to keep memory
+            for window in windows:
+                pending.append(executor.submit(fetch, *window))
+                if len(pending) > concurrency:
+                    page = pd.DataFrame(pending.pop(0).result(), columns=header)
+                    yield page[names] if columns else page
+            for future in pending:
+                page = pd.DataFrame(future.result(), columns=header)
+                yield page[names] if columns else page
+    finally:
+        graph_request(session, 'POST', f'{workbook}/closeSession', retries, check=False)
+        session.close()
+
+def msgraph_upload(workbook_url, sheet_name, dataset, resource, access_token, concurrency=4, retries=5, max_payload=4000000):
+    """
+    Upload dataframe to sheet of excel workbook by graph api in one workbook session,
+    blocks of rows sized to payload limit are written to their ranges at the same time
+    and table is added over them at the end
+
+    """
+    session = graph_session(access_token, concurrency)
+    workbook = urllib.parse.urljoin(resource, workbook_url.lstrip('/')) + '/workbook'
+    sheet = f'{workbook}/worksheets/{sheet_name}'
+    response = graph_request(session, 'POST', f'{workbook}/createSession', retries, json={'persistChanges': True})
+    session.headers['workbook-session-id'] = response.json()['id']
+    try:
+        # try to add worksheet
+        response = graph_request(session, 'POST', f'{workbook}/worksheets', retries, check=False, json={'name': sheet_name})
+        if response.status_code == 201:
+            log.info(f'new sheet added <{sheet_name}>')
+        graph_request(session, 'POST', f"{sheet}/range(address='A:XFD')/clear", retries, json={'applyTo': 'All'})
+        last_column = colnum_string(len(dataset.columns))
+        header = [[str(col) for col in dataset.columns]]
+        graph_request(session, 'PATCH', f"{sheet}/range(address='A1:{last_column}1')", retries, json={'values': header})
+
+        rows = dataset.astype(object).where(dataset.notna(), '').values.tolist()
+        sample = rows[:1000]
+        row_size = len(json.dumps(sample, default=str)) / max(len(sample), 1)
+        block_rows = max(1, int(max_payload * 0.8 / row_size)) # leave room for uneven rows
+
+        def write_block(start, block):
+            body = json.dumps({'values': block}, default=str) # dates as strings
+            response = None
+            if len(body) <= max_payload or len(block) == 1:
+                address = f'A{start + 2}:{last_column}{start + len(block) + 1}'
+                response = graph_request(session, 'PATCH', f"{sheet}/range(address='{address}')", retries, check=False, data=body)
+            if response is None or (response.status_code == 413 and len(block) > 1): # too large, split in halves
+                half = len(block) // 2
+                write_block(start, block[:half])
+                write_block(start + half, block[half:])
+            elif not response.ok:
+                raise RuntimeError(f'graph api error {response.status_code} on rows from {start + 2}: {response.text[:500]}')
+
+        blocks = range(0, len(rows), block_rows)
+        log.debug(f'uploading {len(rows)} rows in {len(blocks)} blocks')
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(lambda start: write_block(start, rows[start:start + block_rows]), blocks))
+        # add table over written data
+        address = f'A1:{last_column}{len(rows) + 1}'
+        graph_request(session, 'POST', f'{sheet}/tables/add', retries, json={'address': address, 'hasHeaders': True, 'name': sheet_name})
+    finally:
+        graph_request(session, 'POST', f'{workbook}/closeSession', retries, check=False)
+        session.close()
+
+@functools.lru_cache(maxsize=None)
+def bigquery_client(project_id, credentials_path=None, emulator=None):
+    """
+    BigQuery client and storage read api client, kept for next jobs of the process.
+    With emulator url requests go to local emulator without credentials
+
+    """
+    bigquery = __import__('google.cloud.bigquery', fromlist=['Client'])
+    if emulator: # e.g. bigquery-emulator, result is read by rest api
+        credentials = __import__('google.auth.credentials', fromlist=['AnonymousCredentials'])
+        client = bigquery.Client(project=project_id, credentials=credentials.AnonymousCredentials(),
+                                 client_options={'api_endpoint': emulator})
+        return client, None
+    credentials = None
+    if credentials_path:
+        service_account = __import__('google.oauth2.service_account', fromlist=['Credentials'])
+        credentials = service_account.Credentials.from_service_account_file(
+            os.path.expanduser(credentials_path),
+            scopes=['https://www.googleapis.com/auth/bigquery'],
+        )
+    client = bigquery.Client(project=project_id, credentials=credentials)
+    try: # storage read api streams result by arrow batches from several streams
+        bigquery_storage = __import__('google.cloud.bigquery_storage', fromlist=['BigQueryReadClient'])
+        storage_client = bigquery_storage.BigQueryReadClient(credentials=credentials)
+    except ImportError:
+        log.debug('google-cloud-bigquery-storage is not installed, result is read by rest api')
+        storage_client = None
+    return client, storage_client
+
+def bigquery_chunks(client, storage_client, query, chunksize=None):
+    rows = client.query(query).result()
+    for table in rebatch(rows.to_arrow_iterable(bqstorage_client=storage_client), chunksize):
+        yield arrow_to_pandas(table)
+
+def bigquery_load(client, dataset, table_id, if_exists='append', **params):
+    """
+    Load dataframe or chunks to bigquery table by one parquet load job,
+    file is kept in memory up to 256 MiB and goes to disk over it
+
+    """
+    bigquery = __import__('google.cloud.bigquery', fromlist=['LoadJobConfig'])
+    dispositions = {'append': 'WRITE_APPEND', 'replace': 'WRITE_TRUNCATE', 'fail': 'WRITE_EMPTY'}
+    job_config = bigquery.LoadJobConfig(source_format='PARQUET', write_disposition=dispositions[if_exists], **params)
+    with tempfile.SpooledTemporaryFile(max_size=256 * 1024**2) as buffer:
+        # bigquery takes timestamps in microseconds
+        write_parquet_chunks(iter_chunks(dataset), buffer, coerce_timestamps='us', allow_truncated_timestamps=True)
+        buffer.seek(0)
+        job = client.load_table_from_file(buffer, table_id, job_config=job_config)
+        job.result()
+    return job.output_rows
+
+class Metrics:
+    """
+    Duration, rows, bytes and peak rss of job stages, time of stage
+    excludes nested stages, rss is sampled in background thread
+
+    """
+    def __init__(self, name, profile_stage=None):
+        self.name = name
+        self.profile_stage = profile_stage
+        self.started = time.time()
+        self.stages = {}
+        self.open = [] # [name, started, nested seconds, profiler]
+        self.lock = threading.Lock()
+        self.process = psutil.Process()
+        self.finished = threading.Event()
+        threading.Thread(target=self.sample, daemon=True).start()
+
+    def sample(self, interval=0.05):
+        while not self.finished.wait(interval):
+            self.update_rss()
+
+    def update_rss(self):
+        rss = self.process.memory_info().rss
+        with self.lock:
+            for frame in self.open:
+                record = self.stages[frame[0]]
+                record['peak_rss'] = max(record['peak_rss'], rss)
+
+    def begin(self, name):
+        profiler = None
+        if name == self.profile_stage:
+            profiler = __import__('cProfile').Profile()
+            __import__('tracemalloc').start()
+            profiler.enable()
+        with self.lock:
+            record = self.stages.setdefault(name, {'seconds': 0.0, 'rows': 0, 'bytes': 0, 'peak_rss': 0})
+            self.open.append([name, time.perf_counter(), 0.0, profiler])
+        self.update_rss()
+        return record
+
+    def end(self, name):
+        self.update_rss()
+        with self.lock:
+            while self.open: # stages left open by errors are closed too
+                frame = self.open.pop()
+                elapsed = time.perf_counter() - frame[1]
+                self.stages[frame[0]]['seconds'] += elapsed - frame[2]
+                if self.open:
+                    self.open[-1][2] += elapsed
+                if frame[3]:
+                    self.log_profile(frame[0], frame[3])
+                if frame[0] == name:
+                    break
+
+    def log_profile(self, name, profiler):
+        profiler.disable()
+        tracemalloc = __import__('tracemalloc')
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        stats = io.StringIO()
+        __import__('pstats').Stats(profiler, stream=stats).sort_stats('cumulative').print_stats(25)
+        log.info(f'profile of stage <{name}>:\n{stats.getvalue()}')
+        top = '\n'.join(str(stat) for stat in snapshot.statistics('lineno')[:10])
+        log.info(f'memory allocated in stage <{name}>:\n{top}')
+
+    def close(self):
+        if self.open:
+            self.end(self.open[0][0])
+        self.finished.set()
+
+    def as_dict(self):
+        stages = {}
+        for name, record in self.stages.items():
+            seconds = record['seconds']
+            stages[name] = {**record, 'seconds': round(seconds, 6),
+                            'rows_per_second': round(record['rows'] / seconds, 1) if seconds else None,
+                            'bytes_per_second': round(record['bytes'] / seconds, 1) if seconds else None}
+        return {'job': self.name, 'started': datetime.datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+                'seconds': round(time.time() - self.started, 6),
+                'peak_rss': max([r['peak_rss'] for r in self.stages.values()] or [0]), 'stages': stages}
+
+    def report(self):
+        for name, record in self.as_dict()['stages'].items():
+            volume = ''
+            if record['rows']:
+                volume = f", {record['rows']} rows"
+                if record['rows_per_second']:
+                    volume += f", {record['rows_per_second']:.0f} rows/s, {natural_size(record['bytes_per_second'])}/s"
+            log.info(f"stage <{name}>: {record['seconds']:.3f}s{volume}, peak rss {natural_size(record['peak_rss'])}")
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Measure block as stage of current job, nothing is done without --profile or --metrics-file
+
+    """
+    metrics = getattr(job_metrics, 'current', None)
+    if metrics is None:
+        yield None
+        return
+    record = metrics.begin(name)
+    try:
+        yield record
+    finally:
+        metrics.end(name)
+
+def stage_begin(name):
+    """
+    Start stage of current job which spans long block
+
+    """
+    metrics = getattr(job_metrics, 'current', None)
+    if metrics is not None:
+        metrics.begin(name)
+
+def stage_end(name):
+    metrics = getattr(job_metrics, 'current', None)
+    if metrics is not None:
+        metrics.end(name)
+
+def timed(name):
+    """
+    Decorator measuring every call of function as stage of current job
+
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count_rows(name, dataset):
+    """
+    Add rows and bytes of dataframe or streamed chunks to stage of current job
+
+    """
+    metrics = getattr(job_metrics, 'current', None)
+    if metrics is None or dataset is None or is_relation(dataset):
+        return dataset
+    record = metrics.stages.setdefault(name, {'seconds': 0.0, 'rows': 0, 'bytes': 0, 'peak_rss': 0})
+
+    def count(df):
+        record['rows'] += len(df)
+        record['bytes'] += dataframe_bytes(df)
+        return df
+    if isinstance(dataset, pd.DataFrame):
+        return count(dataset)
+    return (count(chunk) for chunk in dataset)
+
+def metered(chunks, name, first=None):
+    """
+    Pass chunks through measuring time of getting them as stage,
+    first chunk of query result includes its execution
+
+    """
+    chunks = iter(chunks)
+    while True:
+        current = first or name
+        with stage(current):
+            chunk = next(chunks, None)
+        if chunk is None:
+            return
+        first = None
+        yield count_rows(current, chunk)
+
+@contextlib.contextmanager
+def measured_job(name, options):
+    """
+    Collect metrics of job when --profile or --metrics-file is set
+
+    """
+    if not (options.profile or options.profile_stage or options.metrics_file):
+        yield
+        return
+    metrics = Metrics(name, options.profile_stage)
+    job_metrics.current = metrics
+    status = 'ok'
+    try:
+        yield
+    except BaseException as e:
+        if not isinstance(e, SystemExit) or e.code:
+            status = 'failed'
+        raise
+    finally:
+        metrics.close()
+        job_metrics.current = None
+        if options.profile or options.profile_stage:
+            metrics.report()
+        collected_metrics.append({**metrics.as_dict(), 'status': status})
+
+def write_metrics(path, jobs):
+    """
+    Write metrics of jobs to json file or to prometheus textfile for .prom extension
+
+    """
+    create_dir(path)
+    if path.endswith('.prom'):
+        label = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"')
+        families = [ # each metric is one block of description, type and all its samples
+            ('etl_job_failed', 'Job finished with error', [({}, int(job['status'] != 'ok'), job) for job in jobs]),
+            ('etl_job_seconds', 'Duration of job', [({}, job['seconds'], job) for job in jobs]),
+            ('etl_job_peak_rss_bytes', 'Peak resident memory of job', [({}, job['peak_rss'], job) for job in jobs]),
+        ]
+        for metric, name, description in (('seconds', 'etl_stage_seconds', 'Duration of job stage without nested stages'),
+                                   ('rows', 'etl_stage_rows', 'Rows passed through job stage'),
+                                   ('bytes', 'etl_stage_bytes', 'Bytes of dataframes passed through job stage'),
+                                   ('peak_rss', 'etl_stage_peak_rss_bytes', 'Peak resident memory during job stage')):
+            families.append((name, description, [({'stage': stage}, record[metric], job) for job in jobs for stage, record in job['stages'].items()]))
+        lines = []
+        for name, description, samples in families:
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} gauge']
+            for labels, value, job in samples:
+                labels = ','.join(f'{k}="{label(v)}"' for k, v in {'job': job['job'], **labels}.items())
+                lines.append(f'{name}{{{labels}}} {value}')
+        content = '\n'.join(lines) + '\n'
+    else:
+        content = json.dumps(jobs[0] if len(jobs) == 1 else {'jobs': jobs}, indent=2)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as f: # textfile collectors must not see partial file
+        f.write(content)
+    os.replace(temp_path, path)
+    log.info(f'metrics saved to file <{path}>')
+
+@timed('config')
 def get_source(source):
     if '://' in source:
         result = source
@@ -180,15 +717,635 @@ def natural_size(num):
         formatted_num = f"{abs_num * (1 if num >= 0 else -1):.1f}"
     return f"{formatted_num} {units[i]}"
 
+def dataframe_bytes(df):
+    """
+    Memory of dataframe including python objects of its values
+
+    """
+    try:
+        return int(df.memory_usage(index=True, deep=True).sum())
+    except NotImplementedError: # arrow types like intervals have no python objects to measure
+        return int(df.memory_usage(index=True).sum())
+
 def dataframe_size_info(df):
     assert isinstance(df, pd.DataFrame), type(df)
     if df.empty:
         memory_usage = 0  # Set to zero if the DataFrame is empty
     else:
-        memory_usage = df.memory_usage(index=True, deep=True).sum()
+        memory_usage = dataframe_bytes(df)
     volume = natural_size(memory_usage)
     return f'{volume} of data received in amount of {df.shape[0]} rows, {df.shape[1]} columns, {df.size} cells'
 
+date_pattern = re.compile(r'^\d{4}-\d{2}-\d{2}([ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?$')
+
+def optimize_series(series, stream=False, numeric=True):
+    """
+    Series with smaller dtype: low cardinality strings to category, iso dates to datetime,
+    other strings to arrow strings, numbers downcasted without loss unless numeric is False,
+    in stream only types which do not depend on values of chunk are changed
+
+    """
+    if not isinstance(series.dtype, pd.CategoricalDtype) and pd.api.types.is_string_dtype(series.dtype) and pd.api.types.infer_dtype(series, skipna=True) == 'string':
+        values = series.dropna()
+        if not stream and len(values) and date_pattern.match(values.iloc[0]):
+            try: # parse dates once instead of in every writer
+                return pd.to_datetime(series, format='ISO8601')
+            except (ValueError, TypeError, OverflowError):
+                pass
+        if not stream and values.nunique() < len(series) // 2:
+            return series.astype('category')
+        if pd.api.types.is_object_dtype(series.dtype):
+            return series.astype('string[pyarrow]' if importlib.util.find_spec('pyarrow') else 'string')
+        return series
+    if stream or not numeric:
+        return series
+    if pd.api.types.is_float_dtype(series.dtype) and not isinstance(series.dtype, pd.ArrowDtype):
+        values = series.dropna()
+        if len(values) and (values % 1 == 0).all() and values.abs().max() < 2**63: # integers with nulls
+            return pd.to_numeric(series.astype('Int64'), downcast='integer')
+        if series.dtype == 'float64' and (values.astype('float32').astype('float64') == values).all(): # nan is not equal to itself
+            return series.astype('float32')
+    elif pd.api.types.is_integer_dtype(series.dtype) and not isinstance(series.dtype, pd.ArrowDtype):
+        return pd.to_numeric(series, downcast='unsigned' if pd.api.types.is_unsigned_integer_dtype(series.dtype) else 'integer')
+    return series
+
+def optimize_dtypes(dataset, numeric=True):
+    """
+    Cut memory of dataset by smaller dtypes and log bytes saved per column,
+    chunks of stream keep the same schema, numeric=False keeps number types
+    which would become column types of created sql table
+
+    """
+    stream = not isinstance(dataset, pd.DataFrame)
+    before, after, types = {}, {}, {}
+
+    def optimize(df):
+        df = df.copy(deep=False)
+        for i, column in enumerate(df.columns):
+            series = df.iloc[:, i]
+            optimized = optimize_series(series, stream, numeric)
+            if optimized is not series:
+                before[column] = before.get(column, 0) + series.memory_usage(index=False, deep=True)
+                after[column] = after.get(column, 0) + optimized.memory_usage(index=False, deep=True)
+                types[column] = f'{series.dtype} -> {optimized.dtype}'
+                df.isetitem(i, optimized)
+        return df
+
+    def report():
+        for column in before:
+            log.info(f'column <{column}> {types[column]}: {natural_size(before[column])} -> {natural_size(after[column])}, {natural_size(before[column] - after[column])} saved')
+        log.info(f'dtypes optimized: {natural_size(sum(before.values()) - sum(after.values()))} saved')
+
+    if not stream:
+        dataset = optimize(dataset)
+        report()
+        return dataset
+
+    def chunks():
+        for chunk in dataset:
+            yield optimize(chunk)
+        report()
+    return chunks()
+
+def read_sql_chunks(query, engine, chunksize, **kwargs):
+    """
+    Stream query result by chunks using server side cursor
+
+    """
+    with engine.connect() as connection:
+        connection = connection.execution_options(stream_results=True, max_row_buffer=chunksize)
+        yield from pd.read_sql(sql=query, con=connection, chunksize=chunksize, **kwargs)
+
+def arrow_to_pandas(table):
+    """
+    Convert arrow table to dataframe backed by arrow arrays without copying
+
+    """
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+def is_arrow_backed(df):
+    return any(isinstance(dtype, pd.ArrowDtype) for dtype in df.dtypes)
+
+def rebatch(reader, chunksize=None):
+    """
+    Group record batches of reader into arrow tables of chunksize rows,
+    larger batches are sliced, whole result is a single table when chunksize is not set
+
+    """
+    pa = __import__('pyarrow')
+    schema = getattr(reader, 'schema', None) # plain iterator of batches takes schema of first batch
+    batches, rows = [], 0
+    for batch in reader:
+        while chunksize and rows + batch.num_rows >= chunksize:
+            batches.append(batch.slice(0, chunksize - rows)) # slices share memory of batch
+            yield pa.Table.from_batches(batches, schema=schema)
+            batch, batches, rows = batch.slice(chunksize - rows), [], 0
+        if batch.num_rows or not chunksize:
+            batches.append(batch)
+            rows += batch.num_rows
+    if batches or not chunksize:
+        yield pa.Table.from_batches(batches, schema=schema) if batches or schema else pa.table({})
+
+def literal_dialect(dialect):
+    """
+    Copy of dialect rendering plain sql text, percent signs are kept single
+    unlike in sql of dbapi drivers with format paramstyle, server settings
+    like standard_conforming_strings are kept
+
+    """
+    dialect = copy.copy(dialect)
+    dialect.paramstyle = 'named'
+    dialect.identifier_preparer = dialect.preparer(dialect)
+    dialect.statement_compiler = type('LiteralCompiler', (dialect.statement_compiler,), {'post_process_text': lambda self, text: text})
+    return dialect
+
+def render_query(query, engine):
+    """
+    Sql text of query with bound values rendered as literals for drivers used directly
+
+    """
+    if isinstance(query, str):
+        return query
+    dialect = engine.dialect
+    if dialect.paramstyle in ('format', 'pyformat'): # adbc, clickhouse client and scripts take % as is
+        dialect = literal_dialect(dialect)
+    return str(query.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+
+def duckdb_arrow_batches(query, engine, chunksize=None):
+    with engine.connect() as connection:
+        duckdb_conn = connection.connection.driver_connection
+        result = duckdb_conn.execute(render_query(query, engine))
+        if hasattr(result, 'to_arrow_reader'):
+            reader = result.to_arrow_reader(chunksize or 1000000)
+        else: # duckdb < 1.4
+            reader = result.fetch_record_batch(chunksize or 1000000)
+        yield from rebatch(reader, chunksize)
+
+def duckdb_chunks(result, chunksize=None):
+    if hasattr(result, 'to_arrow_reader'):
+        reader = result.to_arrow_reader(chunksize or 1000000)
+    else: # duckdb < 1.4
+        reader = result.fetch_record_batch(chunksize or 1000000)
+    for table in rebatch(reader, chunksize):
+        yield arrow_to_pandas(table)
+
+def is_relation(dataset):
+    return type(dataset).__name__ == 'DuckDBPyRelation'
+
+def duckdb_scan(connection, path, **params):
+    """
+    Relation on csv, json or parquet files read by duckdb only when queried,
+    queries read only needed columns and row groups
+
+    """
+    if path.endswith('.parquet'):
+        params.setdefault('hive_partitioning', True) # key=value folders become columns
+        return connection.read_parquet(path, **params)
+    if path.endswith('.json'):
+        return connection.read_json(path, **params)
+    return connection.read_csv(path, **params)
+
+def duckdb_scan_params(path, params):
+    """
+    Parameters of duckdb reader for pandas parameters of csv, json or parquet file,
+    None if some of them have no duckdb equivalent or json layout is read only by pandas
+
+    """
+    if path.endswith('.parquet'):
+        return dict(params) if set(params) <= {'hive_partitioning', 'union_by_name', 'filename'} else None
+    if path.endswith('.json'):
+        if set(params) - {'lines', 'orient'}:
+            return None
+        if params.get('lines'):
+            return {'format': 'newline_delimited'}
+        if params.get('orient', 'records') != 'records':
+            return None
+        with open(path, 'rb') as json_file: # pandas default layout {column: {index: value}} is one object
+            head = json_file.read(4096).lstrip()
+        return {'format': 'array'} if head.startswith(b'[') else None
+    scan_params = {}
+    for key, value in params.items():
+        if key == 'sep':
+            scan_params['sep'] = value
+        elif key == 'header' and value in (0, None, False): # row number of header in pandas
+            scan_params['header'] = value == 0 and value is not False
+        elif key == 'encoding' and str(value).lower().replace('_', '-') in ('utf-8', 'utf8'):
+            continue
+        else: # chunksize, engine, other encodings
+            return None
+    return scan_params
+
+def read_parquet_scan(path, chunksize=None, **params):
+    """
+    Read parquet files of glob by duckdb
+
+    """
+    import duckdb
+    chunks = duckdb_chunks(duckdb_scan(duckdb.connect(), path, **params), chunksize)
+    return chunks if chunksize else collect_chunks(chunks)
+
+def transform_connect(**config):
+    """
+    Dedicated duckdb connection of transform, settings like threads, memory_limit
+    and temp_directory let large queries spill to disk
+
+    """
+    import duckdb
+    return duckdb.connect(config=config)
+
+def copy_options(target, params):
+    """
+    Options of duckdb COPY writing csv or parquet target, None if target needs pandas writer
+
+    """
+    if target.endswith('.parquet') and set(params) <= {'compression', 'row_group_size'}:
+        return ', '.join(['format parquet'] + [f'{k} {v}' for k, v in params.items()])
+    if target.endswith('.csv') and set(params) <= {'sep', 'header'} and params.get('header', True) in (True, False):
+        header = 'true' if params.get('header', True) else 'false'
+        return f"format csv, delimiter '{params.get('sep', ';')}', header {header}"
+    return None
+
+def adbc_arrow_batches(query, engine, chunksize=None):
+    if engine.dialect.name == 'sqlite':
+        adbc = __import__('adbc_driver_sqlite.dbapi', fromlist=['connect'])
+        uri = engine.url.database or ':memory:'
+    else:
+        adbc = __import__('adbc_driver_postgresql.dbapi', fromlist=['connect'])
+        uri = engine.url.set(drivername='postgresql').render_as_string(hide_password=False)
+    with adbc.connect(uri) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(render_query(query, engine))
+            yield from rebatch(cursor.fetch_record_batch(), chunksize)
+
+def clickhouse_arrow_batches(query, engine, chunksize=None):
+    pa = __import__('pyarrow')
+    with engine.connect() as connection:
+        cursor = connection.connection.cursor()
+        try:
+            columns, types = cursor._client.execute(render_query(query, engine), columnar=True, with_column_types=True)
+        finally:
+            cursor.close()
+    names = [name for name, _ in types]
+    table = pa.table(columns or [[] for _ in names], names=names)
+    reader = pa.RecordBatchReader.from_batches(table.schema, table.to_batches(chunksize))
+    yield from rebatch(reader, chunksize)
+
+def get_arrow_reader(engine):
+    """
+    Choose columnar extract function for dialect, None if driver has no arrow interface
+
+    """
+    try:
+        __import__('pyarrow')
+    except ImportError:
+        return None
+    dialect, driver = engine.dialect.name, engine.dialect.driver
+    adbc_drivers = {'sqlite': 'adbc_driver_sqlite', 'postgresql': 'adbc_driver_postgresql'}
+    if dialect == 'duckdb':
+        return duckdb_arrow_batches
+    if dialect == 'clickhouse' and driver == 'native':
+        return clickhouse_arrow_batches
+    if dialect in adbc_drivers:
+        try:
+            __import__(adbc_drivers[dialect])
+            return adbc_arrow_batches
+        except ImportError:
+            pass
+    return None
+
+def read_sql_arrow(query, engine, chunksize=None):
+    """
+    Extract query result to dataframe backed by arrow arrays,
+    iterator of dataframes when chunksize is set
+
+    """
+    arrow_batches = get_arrow_reader(engine)
+    if arrow_batches is None: # rows are converted by pandas directly to arrow dtypes
+        log.debug(f'no arrow interface for dialect <{engine.dialect.name}+{engine.dialect.driver}>, using pandas')
+        if chunksize:
+            return read_sql_chunks(query, engine, chunksize, dtype_backend='pyarrow')
+        return pd.read_sql(sql=query, con=engine, dtype_backend='pyarrow')
+    if chunksize:
+        return (arrow_to_pandas(table) for table in arrow_batches(query, engine, chunksize))
+    table, = arrow_batches(query, engine)
+    return arrow_to_pandas(table)
+
+def partition_bounds(low, high, partitions):
+    """
+    Split range of numbers or dates to list of (low, high) bounds
+
+    """
+    if isinstance(low, datetime.date) and not isinstance(low, datetime.datetime): # date type
+        bounds = pd.date_range(pd.Timestamp(low), pd.Timestamp(high), periods=partitions + 1)
+        bounds = sorted(set(d.date() for d in bounds)) 
+    elif isinstance(low, (datetime.datetime, pd.Timestamp)):
+        bounds = pd.date_range(pd.Timestamp(low), pd.Timestamp(high), periods=partitions + 1)
+        bounds = [d.to_pydatetime() for d in bounds]
+    elif isinstance(low, (int, np.integer)) and isinstance(high, (int, np.integer)):
+        step = max(-(-(int(high) - int(low)) // partitions), 1)
+        bounds = list(range(int(low), int(high), step)) + [int(high)]
+    elif isinstance(low, (float, np.floating, decimal.Decimal)):
+        bounds = list(np.linspace(float(low), float(high), partitions + 1))
+    else:
+        raise TypeError(f'partition column must be numeric or date, got {type(low).__name__}')
+    if len(bounds) < 2: # single value
+        bounds = [bounds[0], bounds[0]]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def read_sql_partitions(query, engine, column, partitions, extract_engine='pandas', chunksize=None, **kwargs):
+    """
+    Extract query result by ranges of partition column in parallel connections,
+    query can place range condition with {partition} placeholder or is wrapped in subquery
+
+    Partitions are concatenated in order, or yielded in order by chunks when chunksize is set,
+    then only the next partition is read ahead to keep memory of few partitions
+    """
+    params = query.compile().params if hasattr(query, 'compile') else {} # user args bound in query
+    query = str(query)
+    name = column.split('.')[-1] # name of column in subquery result, t.id is id
+    if '{partition}' in query:
+        template = query
+    else:
+        template = f'select * from ({query}) etl_partition where {{partition}}'
+        column = name
+    bounds_query = sqlalchemy.text(f"select min({name}), max({name}) from ({template.replace('{partition}', '1=1')}) etl_bounds")
+    with engine.connect() as connection:
+        low, high = connection.execute(bounds_query.bindparams(**params) if params else bounds_query).one()
+    if low is None: # empty result
+        ranges = []
+        queries = [sqlalchemy.text(template.replace('{partition}', '1=1'))]
+        if params:
+            queries = [queries[0].bindparams(**params)]
+    else:
+        ranges = partition_bounds(low, high, partitions)
+        queries = []
+        for i, (lo, hi) in enumerate(ranges):
+            condition = f'{column} >= :etl_lo and {column} ' + ('<= :etl_hi' if i == len(ranges) - 1 else '< :etl_hi')
+            if i == 0: # rows without partition value go to the first partition
+                condition = f'({condition} or {column} is null)'
+            queries.append(sqlalchemy.text(template.replace('{partition}', condition)).bindparams(**params, etl_lo=lo, etl_hi=hi))
+    log.debug(f'partition ranges: {ranges}')
+
+    def read_partition(partition_query):
+        if extract_engine == 'arrow':
+            return read_sql_arrow(partition_query, engine, **kwargs)
+        return pd.read_sql(sql=partition_query, con=engine, **kwargs)
+
+    def read_chunks():
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            futures, rows = [executor.submit(read_partition, queries[0])], 0
+            for i in range(len(queries)):
+                if i + 1 < len(queries): # next partition is read while current is passed to target
+                    futures.append(executor.submit(read_partition, queries[i + 1]))
+                df = futures.pop(0).result()
+                rows += len(df)
+                for start in range(0, len(df), chunksize):
+                    yield df.iloc[start:start + chunksize]
+            if not rows: # columns of empty result
+                yield df
+
+    if chunksize:
+        return read_chunks()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(len(queries), 1)) as executor:
+        return collect_chunks(list(executor.map(read_partition, queries))) # keeps order of partitions
+
+def log_chunks(chunks):
+    """
+    Pass chunks through and log received volume
+
+    """
+    rows, count = 0, 0
+    for chunk in chunks:
+        count += 1
+        rows += len(chunk)
+        log.debug(f'chunk {count}: {dataframe_size_info(chunk)}')
+        yield chunk
+    log.info(f'{rows} rows received in {count} chunks')
+
+def fetched(chunks):
+    """
+    Pass streamed chunks to target, error of fetching next chunk stops job
+    like error of extract, instead of being taken for error of target
+
+    """
+    try:
+        yield from chunks
+    except Exception as e:
+        log.error(e)
+        sys.exit(1)
+
+@contextlib.contextmanager
+def atomic_path(path):
+    """
+    Temporary path of file target in the same folder, moved to path when writing succeeded,
+    failed run leaves previous file untouched and no half-written one
+
+    """
+    temp_path = os.path.join(os.path.dirname(path), f'.etl-{os.getpid()}-{os.path.basename(path)}') # keeps extension for writers
+    try:
+        yield temp_path
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def iter_chunks(dataset):
+    """
+    Iterate over dataset chunks, dataframe is a single chunk
+
+    """
+    if isinstance(dataset, pd.DataFrame):
+        yield dataset
+    else:
+        yield from dataset
+
+def collect_chunks(dataset):
+    """
+    Concatenate streamed chunks for targets which need whole dataset
+
+    """
+    if isinstance(dataset, pd.DataFrame):
+        return dataset
+    chunks = list(dataset)
+    if not chunks:
+        return pd.DataFrame()
+    return pd.concat(chunks, ignore_index=True)
+
+def write_csv_chunks(chunks, path, **params):
+    """
+    Write chunks to one csv file, header only with the first chunk
+
+    """
+    header = params.pop('header', True)
+    encoding = params.pop('encoding', 'utf-8')
+    compression = params.pop('compression', None)
+    if isinstance(compression, str):
+        compression = {'method': compression}
+    params.pop('mode', None)
+    with contextlib.ExitStack() as stack:
+        if compression and compression['method'] == 'zip': # one archive member like pandas does
+            archive = stack.enter_context(zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED))
+            member = compression.get('archive_name') or os.path.basename(path)[:-len('.zip')]
+            stream = stack.enter_context(archive.open(member, 'w', force_zip64=True))
+            f = stack.enter_context(io.TextIOWrapper(stream, encoding=encoding, newline=''))
+        else:
+            f = stack.enter_context(open(path, 'w', encoding=encoding, newline=''))
+        for i, chunk in enumerate(chunks):
+            chunk.to_csv(f, header=header if i == 0 else False, **params)
+
+def write_parquet_chunks(chunks, path, **params):
+    """
+    Write chunks to one parquet file as row groups
+
+    """
+    pa = __import__('pyarrow')
+    pq = __import__('pyarrow.parquet', fromlist=['ParquetWriter'])
+    preserve_index = params.pop('index', False)
+    params.pop('engine', None)
+    writer = None
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=preserve_index)
+            if writer is None: # columns empty in first chunk are strings, values may come later
+                schema = pa.schema([field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+                                    for field in table.schema], metadata=table.schema.metadata)
+                writer = pq.ParquetWriter(path, schema, **params)
+                table = table.cast(schema)
+            else: # keep schema of the first chunk
+                table = table.cast(writer.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+def conform_dtypes(chunk, dtypes):
+    """
+    Cast columns of chunk to dtypes of the first chunk, so all chunks have the same
+    types as whole file read at once, column is left as object if values do not fit
+
+    """
+    for column, dtype in dtypes.items():
+        if column in chunk.columns and chunk[column].dtype != dtype:
+            try:
+                chunk[column] = chunk[column].astype(dtype)
+            except (ValueError, TypeError):
+                chunk[column] = chunk[column].astype(object)
+    return chunk
+
+def read_csv_chunks(source, chunksize, engine=None, **params):
+    """
+    Read csv by chunks of rows, pyarrow engine parses blocks in several threads
+
+    """
+    if engine != 'pyarrow':
+        with pd.read_csv(source, chunksize=chunksize, engine=engine, **params) as reader:
+            dtypes = None
+            for chunk in reader:
+                if dtypes is None: # empty columns of first chunk may get values later
+                    for column in chunk.columns[chunk.isna().all()]:
+                        chunk[column] = chunk[column].astype(object)
+                    dtypes = chunk.dtypes
+                yield conform_dtypes(chunk, dtypes)
+        return
+    pa_csv = __import__('pyarrow.csv', fromlist=['open_csv'])
+    header = params.pop('header', 0)
+    read_options = pa_csv.ReadOptions(
+        encoding=params.pop('encoding', 'utf8'),
+        skip_rows=params.pop('skiprows', 0) + (header or 0),
+        autogenerate_column_names=header is None,
+    )
+    parse_options = pa_csv.ParseOptions(delimiter=params.pop('sep', ','))
+    convert_options = pa_csv.ConvertOptions(include_columns=params.pop('usecols', None))
+    if params:
+        log.warning(f'parameters {list(params)} are not supported by pyarrow csv reader')
+    if isinstance(source, str) and source.endswith('.zip'): # pyarrow reads only plain and gzip/bz2 files
+        archive = zipfile.ZipFile(source)
+        source = archive.open(archive.namelist()[0])
+    with pa_csv.open_csv(source, read_options=read_options, parse_options=parse_options,
+                         convert_options=convert_options) as reader:
+        for table in rebatch(reader, chunksize):
+            yield arrow_to_pandas(table)
+
+def read_csv_source(source, **params):
+    """
+    Read csv file or stdin ('-') to dataframe, inputs with chunksize are streamed by chunks
+
+    """
+    chunksize = params.pop('chunksize', None)
+    if source == '-':
+        source = sys.stdin.buffer
+    if chunksize:
+        log.info(f'streaming data by chunks of {chunksize} rows')
+        return read_csv_chunks(source, chunksize, **params)
+    return pd.read_csv(source, **params)
+
+def read_excel_sheet(path, sheet_name, params):
+    return pd.read_excel(path, sheet_name=sheet_name, **params)
+
+def read_excel_sheets(path, sheet_name='*', **params):
+    """
+    Read all (*) or listed sheets of workbook in parallel processes
+    to one dataframe with sheet_name column
+
+    """
+    if sheet_name == '*':
+        with pd.ExcelFile(path, engine=params.get('engine')) as workbook:
+            sheet_names = workbook.sheet_names
+    else:
+        sheet_names = [name.strip() for name in str(sheet_name).split(',')]
+    workers = min(len(sheet_names), os.cpu_count() or 1)
+    log.info(f'reading {len(sheet_names)} sheets in {workers} processes')
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        frames = list(executor.map(read_excel_sheet, itertools.repeat(path), sheet_names, itertools.repeat(params)))
+    return pd.concat([frame.assign(sheet_name=name) for name, frame in zip(sheet_names, frames)], ignore_index=True)
+
+def excel_rows(sheet_name, dataset):
+    """
+    Header and rows of dataframe or chunks as tuples with None for empty cells
+
+    """
+    max_rows = 1048576
+    rows = 0
+    for chunk in iter_chunks(dataset):
+        if rows == 0:
+            yield tuple(str(column) for column in chunk.columns)
+            rows += 1
+        rows += len(chunk)
+        if rows > max_rows:
+            raise ValueError(f'sheet <{sheet_name}> exceeds excel limit of {max_rows} rows')
+        yield from chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None)
+
+def write_workbook(path, sheets, engine=None):
+    """
+    Write sheets of dataframes or chunks to new workbook in one pass, rows go straight
+    to file by xlsxwriter constant_memory or openpyxl write_only mode
+
+    """
+    if engine is None: # xlsxwriter is faster if installed
+        try:
+            __import__('xlsxwriter')
+            engine = 'xlsxwriter'
+        except ImportError:
+            engine = 'openpyxl'
+    if engine == 'xlsxwriter':
+        xlsxwriter = __import__('xlsxwriter')
+        workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'remove_timezone': True,
+                                              'default_date_format': 'yyyy-mm-dd hh:mm:ss'})
+        for sheet_name, dataset in sheets.items():
+            sheet = workbook.add_worksheet(sheet_name)
+            for i, row in enumerate(excel_rows(sheet_name, dataset)):
+                sheet.write_row(i, 0, row)
+        workbook.close()
+    else:
+        openpyxl = __import__('openpyxl')
+        workbook = openpyxl.Workbook(write_only=True)
+        for sheet_name, dataset in sheets.items():
+            sheet = workbook.create_sheet(sheet_name)
+            for row in excel_rows(sheet_name, dataset):
+                sheet.append(row)
+        workbook.save(path)
+
+@functools.lru_cache(maxsize=None)
 def get_config():
     """
     Detect and get etl config
@@ -225,108 +1382,734 @@ def get_config():
         # log.debug(f'config contains: {cfg}')
     return cfg
 
-def get_query(query, extra_args):
-    try:
-        if query.endswith(('.sql', '.ddl')):
-            if os.path.isfile(query):
-                sql_file_path = query.replace("\r", "")
-                sql = open(sql_file_path, 'r', encoding='utf-8')
-                result = " ".join(sql.readlines())
-            else:
-                log.error(f'query file not found <{query}>')
-                sys.exit(1)
-        else:
-            result = query
-        if extra_args:
-            query_args = {
-                key: str(value).format(**extra_args)
-                for key, value in extra_args.items()
-            }
-            result = str(result).format(**query_args)
-        result = sqlalchemy.text(result)
-        log.debug(f'sql:\n{result}')
-        return result
-    except Exception as e:
-        log.error(e)
+sql_token = re.compile(r"""
+    (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<dollar>\$(?P<tag>[A-Za-z_]*)\$.*?\$(?P=tag)\$)
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<quoted>"(?:[^"]|"")*")
+  | (?P<slash>^[ \t]*/[ \t]*$)
+  | (?P<end>;)
+  | (?P<text>\{\{|\}\}|\{[A-Za-z_]\w*\}|[^-/$'"{};]+|.)
+""", re.VERBOSE | re.DOTALL | re.MULTILINE)
+placeholder = re.compile(r'(\{\{|\}\}|\{[A-Za-z_]\w*\})')
+sql_operand_words = {'select', 'where', 'and', 'or', 'not', 'when', 'then', 'else', 'like', 'ilike', 'between',
+                     'in', 'is', 'by', 'on', 'having', 'values', 'set', 'return', 'escape', 'distinct'} # bind may follow them
+sql_ddl = re.compile(r'^(create|alter|drop|comment|grant|revoke|rename|truncate)\b', re.IGNORECASE)
+sql_block = re.compile(r'^(begin|declare|create\s+(or\s+replace\s+)?(procedure|function|trigger|package|type))\b', re.IGNORECASE)
+
+@functools.lru_cache(maxsize=256)
+def compile_sql(sql):
+    """
+    Parse sql once into statements of tokens: ('text', value), ('arg', name) pasted as is,
+    ('bind', name) for placeholder which is whole string literal like '{rep_date}',
+    ('escape', brace), statements are split by ; except inside blocks of procedures,
+    which end by / line
+
+    """
+    statements, tokens, code = [], [], ''
+    for match in sql_token.finditer(sql):
+        kind, value = match.lastgroup, match.group()
+        if kind == 'tag':
+            kind = 'dollar'
+        if kind == 'string' and re.fullmatch(r"'\{[A-Za-z_]\w*\}'", value):
+            tokens.append(('bind', value[2:-2]))
+        elif kind == 'comment':
+            tokens.append(('text', value))
+        elif kind == 'slash' or (kind == 'end' and not sql_block.match(code)):
+            if kind == 'end':
+                tokens.append(('text', value))
+            statements.append(tokens)
+            tokens, code = [], ''
+        else: # placeholders are pasted also inside literals and quoted names
+            for part in placeholder.split(value):
+                if part in ('{{', '}}'):
+                    tokens.append(('escape', part))
+                elif placeholder.fullmatch(part):
+                    tokens.append(('arg', part[1:-1]))
+                elif part:
+                    tokens.append(('text', part))
+            code = (code + value).lstrip()
+    statements.append(tokens)
+    for statement in statements: # bind is pasted where driver would not see it as parameter, e.g. '{d}'::date or date '{d}'
+        for i, (kind, value) in enumerate(statement):
+            before = statement[i - 1][1] if i and statement[i - 1][0] == 'text' else ''
+            after = statement[i + 1][1] if i + 1 < len(statement) and statement[i + 1][0] == 'text' else ''
+            word = re.search(r'([A-Za-z_]\w*)\s+$', before) # type of typed literal like timestamp or interval
+            if kind == 'bind' and (re.search(r'[\w:\\]$', before) or re.match(r'[\w:]', after)
+                                   or (word and word.group(1).lower() not in sql_operand_words)):
+                statement[i] = ('quoted', value)
+    return tuple(tuple(statement) for statement in statements)
+
+@functools.lru_cache(maxsize=64)
+def read_sql_file(path, mtime, size):
+    """
+    Compiled sql file, cached until file is changed
+
+    """
+    with open(path, 'r', encoding='utf-8') as sql_file:
+        return compile_sql(sql_file.read())
+
+def compile_query(query):
+    if query.endswith(('.sql', '.ddl')):
+        path = query.replace("\r", "")
+        if not os.path.isfile(path):
+            log.error(f'query file not found <{query}>')
+            sys.exit(1)
+        stat = os.stat(path)
+        return read_sql_file(path, stat.st_mtime_ns, stat.st_size)
+    return compile_sql(query)
+
+def render_sql(tokens, args, bind=True):
+    """
+    Sql text and bind parameters of compiled statement, placeholders
+    without values are kept as is, so braces can be used in sql
+
+    """
+    text, params = [], {}
+    for kind, value in tokens:
+        if kind in ('bind', 'quoted') and value in args:
+            if bind and kind == 'bind':
+                text.append(f':{value}')
+                params[value] = args[value]
+            else:
+                text.append(f"'{args[value]}'")
+        elif kind in ('bind', 'quoted'):
+            text.append(f"'{{{value}}}'")
+        elif kind == 'arg':
+            text.append(str(args[value]) if value in args else f'{{{value}}}')
+        elif kind == 'escape':
+            text.append(value[0] if args else value) # like str.format, only when there are args
+        else:
+            text.append(value)
+    return ''.join(text), params
+
+def query_args(extra_args):
+    """
+    Values of user args can refer to other args
+
+    """
+    return {
+        key: re.sub(r'\{([A-Za-z_]\w*)\}', lambda m: str(extra_args.get(m.group(1), m.group(0))), str(value))
+        for key, value in extra_args.items()
+    }
+
+def get_query(query, extra_args, bind=True):
+    """
+    Sql of query text or file with user args, values placed as whole string literals
+    are bound as parameters, so server can reuse plan of statement,
+    bind=False pastes them for engines taking plain sql text
+
+    """
+    try:
+        args = query_args(extra_args or {})
+        text, params = render_sql(itertools.chain.from_iterable(compile_query(query)), args, bind)
+        result = sqlalchemy.text(text)
+        if params:
+            result = result.bindparams(**params)
+        log.debug(f'sql:\n{text}')
+        if params:
+            log.debug(f'parameters: {params}')
+        return result if bind else text
+    except Exception as e:
+        log.error(e)
+
+def get_statements(query, extra_args):
+    """
+    Statements of sql query or file with bound user args, empty ones are skipped,
+    args of ddl statements are pasted as literals, databases do not take binds in ddl
+
+    """
+    args = query_args(extra_args or {})
+    statements = []
+    for tokens in compile_query(query):
+        code = ''.join(value for kind, value in tokens if kind == 'text')
+        code = re.sub(r'--[^\n]*|/\*.*?\*/', '', code, flags=re.DOTALL).strip()
+        text, params = render_sql(tokens, args, bind=not sql_ddl.match(code))
+        code = re.sub(r'--[^\n]*|/\*.*?\*/', '', text, flags=re.DOTALL).strip()
+        if code.rstrip(';').strip():
+            statement = sqlalchemy.text(text.strip() if sql_block.match(code) else text.strip().rstrip(';')) # blocks end by end;
+            statements.append(statement.bindparams(**params) if params else statement)
+    log.debug(f'{len(statements)} statements in <{query}>')
+    return statements
+
+def execute_statements(connection, statements):
+    """
+    Execute statements of sql file as one script where driver takes several statements
+    in one round-trip, one by one in the same transaction otherwise
+
+    """
+    dialect, driver = connection.dialect.name, connection.dialect.driver
+    if len(statements) == 1:
+        return connection.execute(statements[0])
+    if dialect in ('sqlite', 'duckdb') or (dialect == 'postgresql' and driver in ('psycopg2', 'psycopg')) or dialect == 'mssql':
+        script = ';\n'.join(render_query(statement, connection) for statement in statements)
+        driver_connection = connection.connection.driver_connection
+        if dialect == 'sqlite':
+            driver_connection.executescript(script)
+        elif dialect == 'duckdb':
+            driver_connection.execute(script)
+        else:
+            with contextlib.closing(driver_connection.cursor()) as cursor:
+                cursor.execute(script)
+        return None
+    result = None
+    for statement in statements:
+        result = connection.execute(statement)
+    return result
+
+def table_name(table, conn):
+    """
+    Quoted table name with schema for dialect of connection
+
+    """
+    preparer = conn.dialect.identifier_preparer
+    if table.schema:
+        return f'{preparer.quote_schema(table.schema)}.{preparer.quote(table.name)}'
+    return preparer.quote(table.name)
+
+def postgres_copy(table, conn, keys, data_iter):
+    """
+    Insert method for to_sql using postgres COPY FROM STDIN with csv buffer
+
+    """
+    csv = __import__('csv')
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    rows = 0
+    for row in data_iter:
+        writer.writerow(['\\N' if value is None else value for value in row])
+        rows += 1
+    buffer.seek(0)
+    columns = ', '.join(conn.dialect.identifier_preparer.quote(k) for k in keys)
+    sql = f"COPY {table_name(table, conn)} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+    dbapi_conn = conn.connection
+    with dbapi_conn.cursor() as cursor:
+        if hasattr(cursor, 'copy_expert'): # psycopg2
+            cursor.copy_expert(sql=sql, file=buffer)
+        else: # psycopg 3
+            with cursor.copy(sql) as copy:
+                copy.write(buffer.getvalue())
+    return rows
+
+def clickhouse_insert(table, conn, keys, data_iter):
+    """
+    Insert method for to_sql using clickhouse native columnar blocks
+
+    """
+    rows = list(data_iter)
+    columns = ', '.join(conn.dialect.identifier_preparer.quote(k) for k in keys)
+    sql = f'INSERT INTO {table_name(table, conn)} ({columns}) VALUES'
+    cursor = conn.connection.cursor()
+    try:
+        client = getattr(cursor, '_client', None)
+        if client is not None and rows:
+            client.execute(sql, [list(c) for c in zip(*rows)], columnar=True)
+        else:
+            cursor.executemany(sql, rows)
+    finally:
+        cursor.close()
+    return len(rows)
+
+def duckdb_insert(table, conn, keys, data_iter):
+    """
+    Insert method for to_sql registering chunk in duckdb and inserting by select
+
+    """
+    frame = pd.DataFrame.from_records(list(data_iter), columns=keys)
+    dbapi_conn = conn.connection
+    duckdb_conn = getattr(dbapi_conn, 'driver_connection', dbapi_conn)
+    view = f'etl_insert_{os.getpid()}_{id(frame)}'
+    columns = ', '.join(conn.dialect.identifier_preparer.quote(k) for k in keys)
+    duckdb_conn.register(view, frame)
+    try:
+        duckdb_conn.execute(f'INSERT INTO {table_name(table, conn)} ({columns}) SELECT {columns} FROM {view}')
+    finally:
+        duckdb_conn.unregister(view)
+    return len(frame)
+
+def get_bulk_method(engine):
+    """
+    Choose native bulk insert method for dialect, None means default inserts
+
+    """
+    dialect, driver = engine.dialect.name, engine.dialect.driver
+    if dialect == 'postgresql' and driver in ('psycopg2', 'psycopg'):
+        return postgres_copy
+    if dialect == 'clickhouse' and driver == 'native':
+        return clickhouse_insert
+    if dialect == 'duckdb':
+        return duckdb_insert
+    log.debug(f'no bulk method for dialect <{dialect}+{driver}>, using inserts')
+    return None
+
+def upsert_statement(dialect, target, stage, columns, keys):
+    """
+    Set-based statement merging staging table to target table by key columns,
+    on conflict dialects update only changed rows
+
+    """
+    values = [c for c in columns if c not in keys]
+    column_list = ', '.join(columns)
+    key_list = ', '.join(keys)
+    if dialect in ('postgresql', 'sqlite', 'duckdb'):
+        sql = f'INSERT INTO {target} AS tgt ({column_list}) SELECT {column_list} FROM {stage} WHERE true ON CONFLICT ({key_list}) '
+        if not values:
+            return sql + 'DO NOTHING'
+        distinct = 'IS NOT' if dialect == 'sqlite' else 'IS DISTINCT FROM'
+        changed = ' OR '.join(f'tgt.{c} {distinct} excluded.{c}' for c in values)
+        return sql + 'DO UPDATE SET ' + ', '.join(f'{c} = excluded.{c}' for c in values) + f' WHERE {changed}'
+    if dialect in ('mysql', 'mariadb'):
+        if not values:
+            return f'INSERT IGNORE INTO {target} ({column_list}) SELECT {column_list} FROM {stage}'
+        return (f'INSERT INTO {target} ({column_list}) SELECT {column_list} FROM {stage} '
+                'ON DUPLICATE KEY UPDATE ' + ', '.join(f'{c} = VALUES({c})' for c in values))
+    # standard merge for mssql, oracle and others
+    sql = f'MERGE INTO {target} tgt USING {stage} src ON (' + ' AND '.join(f'tgt.{k} = src.{k}' for k in keys) + ')'
+    if values:
+        sql += ' WHEN MATCHED THEN UPDATE SET ' + ', '.join(f'{c} = src.{c}' for c in values)
+    sql += f' WHEN NOT MATCHED THEN INSERT ({column_list}) VALUES (' + ', '.join(f'src.{c}' for c in columns) + ')'
+    return sql + ';' if dialect == 'mssql' else sql
+
+def upsert_load(dataset, engine, table, schema, keys, **load_params):
+    """
+    Load chunks to staging table and merge it to target table by key columns in one transaction,
+    new target table is created with unique index on keys, clickhouse target should be
+    ReplacingMergeTree ordered by keys, rows are inserted and deduplicated by merges
+
+    """
+    keys = [k.strip() for k in str(keys).split(',') if k.strip()]
+    dialect = engine.dialect.name
+    stage = f'etl_stage_{os.getpid()}_{table}'[:60]
+    load_params.pop('if_exists', None)
+    preparer = engine.dialect.identifier_preparer
+    qualify = lambda name: f'{preparer.quote_schema(schema)}.{preparer.quote(name)}' if schema else preparer.quote(name)
+    try:
+        with engine.begin() as conn:
+            if dialect == 'sqlite' and not conn.connection.dbapi_connection.in_transaction: # new table and its index in one transaction
+                conn.exec_driver_sql('BEGIN')
+            if dialect == 'clickhouse' or not sqlalchemy.inspect(conn).has_table(table, schema=schema):
+                for chunk in iter_chunks(dataset):
+                    chunk.to_sql(name=table, schema=schema, con=conn, if_exists='append', **load_params)
+                if dialect != 'clickhouse':
+                    index, target = preparer.quote(f'etl_{table}_key'[:60]), qualify(table)
+                    if dialect == 'sqlite' and schema: # sqlite takes schema in index name, table is in the same schema
+                        index, target = f'{preparer.quote_schema(schema)}.{index}', preparer.quote(table)
+                    conn.execute(sqlalchemy.text(f'CREATE UNIQUE INDEX {index} ON {target} ({", ".join(preparer.quote(k) for k in keys)})'))
+                return None
+            for i, chunk in enumerate(iter_chunks(dataset)):
+                chunk.to_sql(name=stage, schema=schema, con=conn, if_exists='append' if i else 'replace', **load_params)
+            columns = [c['name'] for c in sqlalchemy.inspect(conn).get_columns(stage, schema=schema)]
+            missing = set(keys) - set(columns)
+            if missing:
+                raise ValueError(f'key columns {sorted(missing)} are not in data')
+            sql = upsert_statement(dialect, qualify(table), qualify(stage),
+                                   [preparer.quote(c) for c in columns], [preparer.quote(k) for k in keys])
+            log.debug(f'sql:\n{sql}')
+            return conn.execute(sqlalchemy.text(sql)).rowcount
+    finally: # staging table can outlive rollback where ddl is not transactional
+        if dialect != 'clickhouse':
+            with engine.begin() as conn:
+                conn.execute(sqlalchemy.text(f'DROP TABLE IF EXISTS {qualify(stage)}'))
+
+def swap_statements(preparer, target, shadow, table, exists):
+    """
+    Statements replacing target table by shadow table for dialect of identifier preparer,
+    target and shadow are qualified names, table is name of target without schema
+
+    """
+    dialect = preparer.dialect.name
+    if dialect in ('mysql', 'mariadb'): # rename of several tables is atomic
+        if not exists:
+            return [f'RENAME TABLE {shadow} TO {target}']
+        old = shadow.replace('etl_shadow_', 'etl_old_')
+        return [f'RENAME TABLE {target} TO {old}, {shadow} TO {target}', f'DROP TABLE {old}']
+    if dialect == 'clickhouse':
+        if not exists:
+            return [f'RENAME TABLE {shadow} TO {target}']
+        return [f'EXCHANGE TABLES {target} AND {shadow}', f'DROP TABLE {shadow}']
+    statements = [f'DROP TABLE {target}'] if exists else []
+    if dialect == 'mssql':
+        name = table.replace("'", "''") # new name is taken as is, brackets would become part of it
+        return statements + [f"EXEC sp_rename '{shadow}', '{name}'"]
+    if dialect == 'sqlite': # views of dropped table are not checked during rename
+        return ['PRAGMA legacy_alter_table = ON'] + statements + [f'ALTER TABLE {shadow} RENAME TO {preparer.quote(table)}', 'PRAGMA legacy_alter_table = OFF']
+    return statements + [f'ALTER TABLE {shadow} RENAME TO {preparer.quote(table)}']
+
+def index_statements(conn, table, schema=None, on=None, prefix=''):
+    """
+    Pairs of index name and statement creating index of table, taken from catalog where dialect keeps them,
+    primary key is created as unique index, index can be created on other table with prefixed name
+
+    """
+    dialect = conn.dialect.name
+    params = {'table': table, 'schema': schema}
+    preparer = conn.dialect.identifier_preparer
+    if dialect == 'postgresql':
+        sql = 'select indexname, indexdef from pg_indexes where tablename = :table and schemaname = coalesce(:schema, current_schema())'
+        statements = []
+        for name, definition in conn.execute(sqlalchemy.text(sql), params):
+            if on: # definition is like CREATE UNIQUE INDEX name ON ONLY schema.table USING btree (id)
+                definition = re.sub(r' INDEX .+? ON (ONLY )?.+? USING ', f' INDEX {preparer.quote((prefix + name)[:60])} ON {on} USING ', definition, count=1)
+            statements.append((name, definition))
+        return statements
+    elif dialect == 'sqlite':
+        sql = f"select sql from {conn.dialect.identifier_preparer.quote_schema(schema or 'main')}.sqlite_master where type = 'index' and tbl_name = :table and sql is not null"
+    elif dialect == 'duckdb':
+        sql = 'select sql from duckdb_indexes() where table_name = :table and schema_name = coalesce(:schema, current_schema()) and sql is not null'
+    else:
+        sql = None
+    if sql:
+        return [(None, row[0]) for row in conn.execute(sqlalchemy.text(sql), params)]
+    target = on or (f'{preparer.quote_schema(schema)}.{preparer.quote(table)}' if schema else preparer.quote(table))
+    inspector = sqlalchemy.inspect(conn)
+    indexes = []
+    primary_key = inspector.get_pk_constraint(table, schema=schema).get('constrained_columns')
+    if primary_key:
+        indexes.append({'name': f'{table}_pkey', 'column_names': primary_key, 'unique': True})
+    statements = []
+    for index in indexes + inspector.get_indexes(table, schema=schema):
+        if not index.get('name') or None in index.get('column_names', [None]):
+            log.warning(f'index {index.get("name")} on expressions is not rebuilt, create it again')
+            continue
+        unique = 'UNIQUE ' if index.get('unique') else ''
+        columns = ', '.join(preparer.quote(c) for c in index['column_names'])
+        statements.append((index['name'], f'CREATE {unique}INDEX {preparer.quote((prefix + index["name"])[:60])} ON {target} ({columns})'))
+    return statements
+
+def replace_load(dataset, engine, table, schema, **load_params):
+    """
+    Load chunks to shadow table and swap it with target table in one transaction,
+    readers see old data until commit and failed load keeps target table untouched,
+    indexes of old table are built on shadow table before swap, or after it in sqlite and duckdb
+
+    """
+    dialect = engine.dialect.name
+    preparer = engine.dialect.identifier_preparer
+    qualify = lambda name: f'{preparer.quote_schema(schema)}.{preparer.quote(name)}' if schema else preparer.quote(name)
+    shadow = f'etl_shadow_{os.getpid()}_{table}'[:60]
+    load_params.pop('if_exists', None)
+    prebuilt = dialect not in ('sqlite', 'duckdb', 'clickhouse') # sqlite cannot rename index, duckdb indexed table
+    prefix = f'etl_{os.getpid()}_' if dialect in ('postgresql', 'oracle') else '' # index names are unique in schema
+    try:
+        for i, chunk in enumerate(iter_chunks(dataset)):
+            chunk.to_sql(name=shadow, schema=schema, con=engine, if_exists='append' if i else 'replace', **load_params)
+        indexes = []
+        if prebuilt: # index build does not block readers of target table
+            with engine.begin() as conn:
+                if sqlalchemy.inspect(conn).has_table(table, schema=schema):
+                    indexes = index_statements(conn, table, schema, on=qualify(shadow), prefix=prefix)
+                for _, statement in indexes:
+                    log.debug(f'sql:\n{statement}')
+                    conn.execute(sqlalchemy.text(statement))
+        with engine.begin() as conn:
+            if dialect == 'sqlite' and not conn.connection.dbapi_connection.in_transaction: # pysqlite does not begin before ddl
+                conn.exec_driver_sql('BEGIN')
+            exists = sqlalchemy.inspect(conn).has_table(table, schema=schema)
+            statements = swap_statements(preparer, qualify(table), qualify(shadow), table, exists)
+            if prebuilt and prefix: # old indexes are dropped with old table
+                statements += [f'ALTER INDEX {qualify((prefix + name)[:60])} RENAME TO {preparer.quote(name)}' for name, _ in indexes]
+            elif not prebuilt and exists and dialect != 'clickhouse':
+                statements += [statement for _, statement in index_statements(conn, table, schema)]
+            for statement in statements:
+                log.debug(f'sql:\n{statement}')
+                conn.execute(sqlalchemy.text(statement))
+    finally: # shadow table is left only by failed load or swap
+        with engine.begin() as conn:
+            conn.execute(sqlalchemy.text(f'DROP TABLE IF EXISTS {qualify(shadow)}'))
+
+def cache_dir():
+    return os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'etl')
+
+def cache_key(source, query, extra_args):
+    """
+    Cache key of query result by connection string, final sql text and user parameters
+
+    """
+    bound_values = query.compile().params if hasattr(query, 'compile') else {}
+    payload = json.dumps([source, str(query), bound_values, extra_args], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def cache_read(key, ttl, chunksize=None, arrow=False):
+    """
+    Read cached query result if it is not older than ttl seconds,
+    iterator of dataframes when chunksize is set
+
+    """
+    path = os.path.join(cache_dir(), f'{key}.parquet')
+    if not os.path.isfile(path):
+        return None
+    modified = os.path.getmtime(path)
+    if time.time() - modified > ttl:
+        log.debug(f'cache entry expired <{path}>')
+        os.remove(path)
+        return None
+    os.utime(path, (time.time(), modified)) # access time is used for eviction
+    log.info(f'data taken from cache <{path}>')
+    dtype_backend = {'dtype_backend': 'pyarrow'} if arrow else {}
+    if chunksize:
+        pq = __import__('pyarrow.parquet', fromlist=['ParquetFile'])
+        batches = pq.ParquetFile(path).iter_batches(batch_size=chunksize)
+        return (arrow_to_pandas(b) if arrow else b.to_pandas() for b in batches)
+    return pd.read_parquet(path, **dtype_backend)
+
+def cache_evict(max_size):
+    """
+    Remove least recently used cache entries until cache fits max_size bytes
+
+    """
+    entries = []
+    for entry in os.scandir(cache_dir()):
+        if entry.is_file() and entry.name.endswith('.parquet'):
+            stat = entry.stat()
+            entries.append((stat.st_atime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_size:
+            break
+        os.remove(path)
+        total -= size
+        log.debug(f'cache entry evicted <{path}>')
+
+def cache_write(dataset, key, max_size):
+    """
+    Save query result to cache, streamed chunks are written while passing through
+
+    """
+    os.makedirs(cache_dir(), exist_ok=True)
+    path = os.path.join(cache_dir(), f'{key}.parquet')
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    if isinstance(dataset, pd.DataFrame):
+        try:
+            dataset.to_parquet(temp_path, index=False)
+            os.replace(temp_path, path)
+            log.debug(f'data saved to cache <{path}>')
+            cache_evict(max_size)
+        except Exception as e:
+            log.warning(f'data is not cached: {e}')
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return dataset
+    return cache_chunks(dataset, temp_path, path, max_size)
+
+def cache_chunks(chunks, temp_path, path, max_size):
+    pa = __import__('pyarrow')
+    pq = __import__('pyarrow.parquet', fromlist=['ParquetWriter'])
+    writer = None
+    for chunk in chunks:
+        if temp_path:
+            try:
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(temp_path, table.schema)
+                writer.write_table(table.cast(writer.schema))
+            except Exception as e: # stop caching, data still goes to target
+                log.warning(f'data is not cached: {e}')
+                if writer is not None:
+                    writer.close()
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                temp_path = None
+        yield chunk
+    if temp_path:
+        if writer is not None:
+            writer.close()
+            os.replace(temp_path, path)
+            log.debug(f'data saved to cache <{path}>')
+            cache_evict(max_size)
+
+def state_path():
+    default_path = os.path.join(os.environ.get('XDG_CONFIG_HOME') or '~/.config', 'etl', 'state.db')
+    return os.path.expanduser(os.environ.get('ETL_STATE') or default_path)
+
+def state_connect():
+    """
+    Open local state store with watermarks of incremental extracts
+
+    """
+    sqlite3 = __import__('sqlite3')
+    path = state_path()
+    create_dir(path)
+    connection = sqlite3.connect(path, timeout=60)
+    connection.execute("""
+        create table if not exists watermarks (
+            key text primary key,
+            extract text,
+            column_name text,
+            value text,
+            value_type text,
+            updated_at text
+        )""")
+    return connection
+
+def watermark_key(source, extract, column, target, load):
+    """
+    Watermark key by source, query, column and target without extra parameters
+
+    """
+    parts = [str(p or '').split('??', 1)[0] for p in (source, extract, column, target, load)]
+    return hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()
+
+def get_watermark(key):
+    connection = state_connect()
+    try:
+        row = connection.execute('select value, value_type from watermarks where key = ?', (key,)).fetchone()
+    finally:
+        connection.close()
+    if row is None:
+        return None
+    value, value_type = row
+    parsers = {'int': int, 'float': float, 'date': datetime.date.fromisoformat,
+               'datetime': datetime.datetime.fromisoformat, 'str': str}
+    return parsers[value_type](value)
+
+def set_watermark(key, extract, column, value):
+    if isinstance(value, pd.Timestamp):
+        value = value.to_pydatetime()
+    elif hasattr(value, 'item'): # numpy scalar
+        value = value.item()
+    if isinstance(value, datetime.datetime):
+        value_type = 'datetime'
+    elif isinstance(value, datetime.date):
+        value_type = 'date'
+    elif isinstance(value, bool) or not isinstance(value, (int, float)):
+        value, value_type = str(value), 'str'
+    else:
+        value_type = type(value).__name__
+    text = value.isoformat() if value_type in ('date', 'datetime') else str(value)
+    connection = state_connect()
+    try:
+        with connection:
+            connection.execute('insert or replace into watermarks values (?, ?, ?, ?, ?, ?)',
+                               (key, extract, column, text, value_type, datetime.datetime.now().isoformat()))
+    finally:
+        connection.close()
+    log.info(f'watermark of <{column}> moved to <{text}>')
+
+def incremental_query(query, column, watermark):
+    """
+    Add condition on watermark column, query can place it with {incremental} placeholder
+    or is wrapped in subquery, first run without watermark takes all rows
+
+    """
+    params = query.compile().params if hasattr(query, 'compile') else {} # user args bound in query
+    query = str(query)
+    condition = '1=1' if watermark is None else f'{column} > :etl_watermark'
+    if '{incremental}' in query:
+        result = sqlalchemy.text(query.replace('{incremental}', condition))
+    else:
+        result = sqlalchemy.text(f'select * from ({query}) etl_incremental where {condition}')
+    if watermark is not None:
+        params['etl_watermark'] = watermark
+    return result.bindparams(**params) if params else result
+
+def track_max(chunks, column, state):
+    """
+    Pass chunks through and keep max value of column in state
+
+    """
+    for chunk in chunks:
+        if column in chunk.columns and len(chunk):
+            value = chunk[column].max()
+            if pd.notna(value) and (state.get('value') is None or value > state['value']):
+                state['value'] = value
+        yield chunk
+
+def remove_clob(inputsizes, cursor, statement, parameters, context):
+    # The CLOB datatype in cx_Oracle incurs a significant performance overhead
+    for bindparam, dbapitype in list(inputsizes.items()):
+        if dbapitype is sqlalchemy.CLOB:
+            del inputsizes[bindparam]
+
+def sql_type(name, dialect):
+    """
+    Sqlalchemy type by its sql name like varchar(200) or numeric(18,2),
+    dialect types like oracle number are taken from types known by dialect
+
+    """
+    match = re.match(r'^\s*(\w+)\s*(?:\((.*)\))?\s*$', str(name))
+    if not match:
+        raise ValueError(f'wrong type <{name}>')
+    type_name, args = match.group(1), match.group(2)
+    known = getattr(dialect, 'ischema_names', {})
+    type_class = getattr(sqlalchemy.types, type_name.upper(), None) or known.get(type_name.upper()) or known.get(type_name.lower())
+    if not isinstance(type_class, type) or not issubclass(type_class, sqlalchemy.types.TypeEngine):
+        raise ValueError(f'unknown type <{name}> for dialect <{getattr(dialect, "name", dialect)}>')
+    args = [int(a) if a.strip().isdigit() else a.strip() for a in args.split(',')] if args else []
+    return type_class(*args)
+
+def read_schema(path, dialect):
+    """
+    Column types from yaml file with column: type lines
 
-def create_dir(path):
-    # manage folders if not exist
-    dir = os.path.dirname(path)
-    if dir and not os.path.exists(dir):
-        os.makedirs(dir)
-        log.info(f'folder created <{dir}>')
+    """
+    with open(os.path.expanduser(path), 'r') as schema_file:
+        columns = yaml.safe_load(schema_file) or {}
+    return {str(column): sql_type(type_name, dialect) for column, type_name in columns.items()}
 
-@cli.command(context_settings=dict(ignore_unknown_options=True, allow_extra_args=True))
-@cli.version_option(package_name="etl")
-@cli.pass_context
-@cli.option('--source', required=False, type=str, help="Source for extracting data. Database name, csv or xls filename. Defaults to stdin if not provided.")
-@cli.option('--extract', default='', help="Sql file name for extracting data from database")
-@cli.option('--execute', default='', help="Sql file name for executing without extracting data")
-@cli.option('--transform', default='', help="Sql file name for transforming data in extracted dataset")
-@cli.option('--target', required=False, type=str, help="Target for inserting data. Database name, csv or xls filename. Defaults to stdout if not provided.")
-@cli.option('--load', default='', help="Database schema and table name, if target is database")
-@cli.option('--config-path', default='', help="Custom path to etl.yml config")
-@cli.option('--list', default=False, is_flag=True, help="List named connections from etl.yml and exit.")
-@cli.option('--debug', default=False, is_flag=True, help="Extended level of logging with more info")
-def cli(ctx, **kwargs):
-    global log
-    global options
-    global extra_args
-# logging basic setup
-    log_level = logging.INFO
-    logging.basicConfig(level=log_level, format='%(asctime)s | %(levelname)-5s | %(process)d | %(message)s', datefmt='%Y-%m-%d %H:%M:%S', stream=sys.stderr)
-    log = logging.getLogger()
+def conform_chunks(chunks, dtypes):
+    """
+    Parse string columns declared as date or datetime, drivers take only date objects for them
 
-    class StripCarriageReturnFilter(logging.Filter):
-        def filter(self, record):
-            if isinstance(record.msg, str):
-                record.msg = record.msg.lstrip('\r')
-            return True
+    """
+    dates = [c for c, t in dtypes.items() if isinstance(t, (sqlalchemy.types.Date, sqlalchemy.types.DateTime))]
+    for chunk in chunks:
+        for column in dates:
+            if column in chunk.columns and pd.api.types.is_string_dtype(chunk[column].dtype):
+                chunk = chunk.assign(**{column: pd.to_datetime(chunk[column], format='mixed')})
+        yield chunk
 
-    for handler in logging.getLogger().handlers:
-        handler.addFilter(StripCarriageReturnFilter())
+def infer_schema(df, max_length=4000):
+    """
+    Column types of string columns by first chunk, varchar length is doubled max length
+    rounded to power of two, so next chunks fit too, longer strings stay text
 
-# read cli options and extra args
-    try:
-        options = type('OptionValuesClass', (), ctx.params)
-        extra_args = {ctx.args[i][2:]: ctx.args[i+1] for i in range(0, len(ctx.args), 2)}
-    # except TypeError:
-        # sys.exit(1) # only --help option rise typeError: cannot unpack non-iterable int object
-    except Exception as e:
-        log.error(e)
-        sys.exit(1)
-    if options.debug:
-        log.setLevel(logging.DEBUG)
+    """
+    dtypes = {}
+    for column in df.columns:
+        series = df[column]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            series = series.astype(object)
+        if not pd.api.types.is_string_dtype(series.dtype) or pd.api.types.infer_dtype(series, skipna=True) not in ('string', 'empty'):
+            continue
+        length = int(series.dropna().str.len().max() or 0)
+        if length <= max_length:
+            dtypes[column] = sqlalchemy.types.Unicode(min(max_length, max(16, 1 << (length * 2 - 1).bit_length())))
+    return dtypes
 
-    log.debug(f'project dir <{os.getcwd()}>')
+@timed('engine')
+def get_engine(url, **params):
+    """
+    Create sqlalchemy engine, in manifest and server mode engines keep pooled
+    connections and are shared by jobs with the same connection string
 
-# print cli option in debug mode
-    if options.debug:
-        option_list = [option for option in dir(options) if not option.startswith("__")]
-        o = {}
-        for i in option_list:
-            value = getattr(options,i)
-            if value:
-                o[i] = getattr(options,i)
-        log.debug(f'command options: {o}')
-        if extra_args:
-            log.debug(f'custom params for query: {extra_args}')
-    else:
-        import urllib3
-        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    """
+    if not keep_engines:
+        return sqlalchemy.create_engine(url, **params)
+    params.pop('poolclass', None)
+    if serving: # pooled connections may be idle for hours between jobs
+        params.setdefault('pool_pre_ping', True)
+        params.setdefault('pool_recycle', 1800)
+    key = (url, repr(sorted(params.items())))
+    with engines_lock:
+        if key not in engines:
+            engines[key] = sqlalchemy.create_engine(url, **params)
+    return engines[key]
 
-    if options.list:
-        for alias in get_config():
-            print(alias)
-        return
+def create_dir(path):
+    # manage folders if not exist
+    dir = os.path.dirname(path)
+    if dir and not os.path.exists(dir):
+        os.makedirs(dir)
+        log.info(f'folder created <{dir}>')
 
-# check options
-    if options.extract and options.execute:
-        log.error("options --extract and --execute are mutually exclusive")
-        sys.exit(1)
+def extract_dataset(options, extra_args, transform_connection=None):
+    """
+    Extract dataset from source described by options, csv, json and parquet files
+    are only scanned by transform connection if it is given
 
-# extract dataset from source
-    dataset = pd.DataFrame()
+    """
+    dataset = None
+    incremental = None # watermark column of incremental extract
     if options.source:
         source_params = {}
         if '??' in options.source: # take parameters for engine/source-specific config
@@ -335,35 +2118,48 @@ def cli(ctx, **kwargs):
         else: # parameters after ? will be forwarded directry to source/target
             source = options.source
 
-        if os.path.isfile(source): # file
+        if source == '-' or os.path.isfile(source) or (source.endswith('.parquet') and glob.glob(source)): # file or stdin
             log.debug(f'source params: {source_params}')
-            if source.endswith('.csv') or source.endswith('.csv.zip'):
+            if source == '-' or source.endswith('.csv') or source.endswith('.csv.zip'):
                 source_params.setdefault('header',0) # default params # means you have the names of columns in the first row in the file
                 source_params.setdefault('sep',';') # default params
-                source_method = pd.read_csv
+                source_method = read_csv_source
             if source.endswith('.xlsx') or source.endswith('.xls'):
                 source_params.setdefault('header',0) # default params
                 source_params.setdefault('engine','openpyxl') # default params
                 source_method = pd.read_excel
+                if source_params.get('sheet_name') == '*' or ',' in str(source_params.get('sheet_name', '')):
+                    source_method = read_excel_sheets
             if source.endswith('.parquet'):
-                source_method = pd.read_parquet
+                if glob.has_magic(source) or (options.transform and duckdb_scan_params(source, source_params) is not None): # duckdb reads only columns and row groups needed
+                    source_method = read_parquet_scan
+                else:
+                    source_params.setdefault('memory_map', True) # pages are read from os cache without copying
+                    if isinstance(source_params.get('columns'), str):
+                        source_params['columns'] = source_params['columns'].split(',')
+                    source_method = pd.read_parquet
             if source.endswith('.xml'):
                 source_method = pd.read_xml
             if source.endswith('.json'):
                 source_method = pd.read_json
             try:
-                log.info(f'extracting data from <{source}>')
-                dataset = source_method(source, **source_params)
+                scan_params = duckdb_scan_params(source, source_params) if source.endswith(('.csv', '.parquet', '.json')) else None
+                if transform_connection is not None and scan_params is not None:
+                    log.info(f'scanning data from <{source}> by duckdb')
+                    dataset = duckdb_scan(transform_connection, source, **scan_params)
+                else:
+                    log.info(f'extracting data from <{source}>' if source != '-' else 'extracting data from stdin')
+                    dataset = source_method(source, **source_params)
             except Exception as e:
                 log.error(e)
                 sys.exit(1)
         # extract from sources with connection string
         else:
-            source = get_source(options.source)
-            if '??' in source: # take parameters for sqlalchemy engine
-                source, source_params = source.split('??', 1)
-                source_params = parse_url_params(source_params)
-                log.debug(f'source params: {source_params}')
+            source = get_source(source)
+            if '??' in source: # take parameters for sqlalchemy engine, command line ones have priority
+                source, config_params = source.split('??', 1)
+                source_params = {**parse_url_params(config_params), **source_params}
+            log.debug(f'source params: {source_params}')
 
             if any(s in source for s in special_sources): # any custom sources and apies
                 # extract from google sheets
@@ -381,17 +2177,25 @@ def cli(ctx, **kwargs):
                     token_response, cfg = msgraph_open(source_params.get('credentials'))
                     log.debug(token_response)
                     workbook_url = options.extract
-                    sheet_name = 'data'
+                    extract_params = {}
                     if '??' in options.extract:
-                        workbook_url, sheet_name = options.extract.split('??', 1)
-                        sheet_name = parse_url_params(sheet_name)
-                        sheet_name = sheet_name.pop('sheet_name', 'data')
-                    requests = __import__('requests')
-                    url = workbook_url + f"/workbook/worksheets/{sheet_name}/usedRange()"
-                    response = api_call(requests.get, url, resource=cfg['resource'], access_token=token_response['access_token'])
-                    response
-                    data = response.json()['values']
-                    dataset = pd.DataFrame(data[1:], columns = data[0])
+                        workbook_url, extract_params = options.extract.split('??', 1)
+                        extract_params = parse_url_params(extract_params)
+                    sheet_name = extract_params.pop('sheet_name', 'data')
+                    chunksize = extract_params.pop('chunksize', None)
+                    log.info(f'extracting data from <{workbook_url}> on sheet <{sheet_name}>')
+                    pages = msgraph_pages(workbook_url, sheet_name, cfg['resource'], token_response['access_token'],
+                                          extract_params.get('columns'), extract_params.get('rows'), chunksize,
+                                          source_params.get('concurrency', 4), source_params.get('retries', 5))
+                    if chunksize: # pages go to target while next ones are read
+                        log.info(f'streaming data by chunks of {chunksize} rows')
+                        dataset = pages
+                    else:
+                        try:
+                            dataset = collect_chunks(pages)
+                        except Exception as e:
+                            log.error(e)
+                            sys.exit(1)
 
                 # extract csv from internent
                 if any(s in source for s in ['http','https','ftp']) and source.endswith('.csv'):
@@ -407,21 +2211,12 @@ def cli(ctx, **kwargs):
                 if 'bigquery://' in source:
                     log.debug(f'source params: {source_params}')
                     project_id = urlparse(source).hostname
-                    gbq_params = {}
-                    if source_params.get('credentials_path'):
-                        service_account = __import__('google.oauth2.service_account', fromlist=['Credentials'])
-                        credentials_path = os.path.expanduser(source_params['credentials_path'])
-                        gbq_params['credentials'] = service_account.Credentials.from_service_account_file(
-                            credentials_path,
-                            scopes=['https://www.googleapis.com/auth/bigquery'],
-                        )
+                    client, storage_client = bigquery_client(project_id, source_params.get('credentials_path'), source_params.get('emulator'))
                     if options.execute:
                         log.info(f'executing <{options.execute}> on <{options.source}>')
-                        source_query = get_query(options.execute, extra_args)
-                        bigquery = __import__('google.cloud.bigquery', fromlist=['Client'])
-                        client = bigquery.Client(project=project_id, credentials=gbq_params.get('credentials'))
+                        source_query = get_query(options.execute, extra_args, bind=False)
                         try:
-                            query_job = client.query(str(source_query))
+                            query_job = client.query(source_query)
                             query_job.result()  # Waits for job to complete.
                             if extra_args:
                                 log.info(f'executed <{options.execute}> with user_variables {extra_args}')
@@ -432,67 +2227,243 @@ def cli(ctx, **kwargs):
                             sys.exit(1)
                     if options.extract:
                         log.info(f'extracting data from <{options.source}> using query <{options.extract}>')
-                        source_query = get_query(options.extract, extra_args)
-                        try:
-                            pandas_gbq = __import__('pandas_gbq')
-                            dataset = pandas_gbq.read_gbq(
-                                str(source_query),
-                                project_id=project_id,
-                                dialect='standard',
-                                progress_bar_type=None,
-                                **gbq_params,
-                            )
-                        except Exception as e:
-                            log.error(e)
-                            sys.exit(1)
+                        extract, _, extract_params = options.extract.partition('??')
+                        chunksize = parse_url_params(extract_params).get('chunksize')
+                        source_query = get_query(extract, extra_args, bind=False)
+                        chunks = bigquery_chunks(client, storage_client, source_query, chunksize)
+                        if chunksize: # stream result by chunks
+                            log.info(f'streaming data by chunks of {chunksize} rows')
+                            dataset = chunks
+                        else:
+                            try:
+                                dataset = collect_chunks(chunks)
+                            except Exception as e:
+                                log.error(e)
+                                sys.exit(1)
             else:
                 try:
                     source_params.setdefault('max_identifier_length',128) # default params
-                    source_engine = sqlalchemy.create_engine(source, poolclass=NullPool, **source_params)
+                    extract_engine = source_params.pop('engine', 'pandas') # pandas, arrow or auto
+                    extract_params = {}
+                    extract = options.extract
+                    if '??' in extract: # take parameters for extracting data
+                        extract, extract_params = extract.split('??', 1)
+                        extract_params = parse_url_params(extract_params)
+                        log.debug(f'extract params: {extract_params}')
+                    incremental = extract_params.pop('incremental', None)
+                    partition_column = extract_params.pop('partition_column', None)
+                    partitions = extract_params.pop('partitions', 4)
+                    if partition_column: # connection for each partition query
+                        source_params.update(pool_size=partitions, max_overflow=0)
+                    else:
+                        source_params['poolclass'] = sqlalchemy.pool.NullPool
+                    source_engine = get_engine(source, **source_params)
+                    if extract_engine == 'auto' and options.extract: # arrow if driver has columnar interface
+                        extract_engine = 'arrow' if get_arrow_reader(source_engine) else 'pandas'
                     if options.execute:
                         log.info(f'executing <{options.execute}> on <{options.source}>')
-                        source_query = get_query(options.execute, extra_args)
+                        statements = get_statements(options.execute, extra_args)
                         if sqlalchemy.__version__.startswith("2"):  # SQLAlchemy 2.0+
-                            with source_engine.begin() as connection:
-                                execution_result = connection.execute(source_query)
+                            with source_engine.begin() as connection: # statements of file are executed in one transaction
+                                execution_result = execute_statements(connection, statements)
                         else: # SQLAlchemy < 2.0
-                            execution_result = source_engine.execute(source_query)
-                        if execution_result.rowcount >= 0:
+                            execution_result = source_engine.execute(statements[0]) if len(statements) == 1 else execute_statements(source_engine.connect(), statements)
+                        if len(statements) > 1:
+                            log.info(f'executed <{options.execute}>, {len(statements)} statements')
+                        elif execution_result.rowcount >= 0:
                             log.info(f'executed <{options.execute}>, rowcount={execution_result.rowcount}')
                         else:
                             log.info(f'executed <{options.execute}>')
                     if options.extract:
-                        log.info(f'extracting data from <{options.source}> using query <{options.extract}>')
-                        source_query = get_query(options.extract, extra_args)
-                        dataset = pd.read_sql(sql=source_query, con=source_engine)
+                        log.info(f'extracting data from <{options.source}> using query <{extract}>')
+                        placeholders = {} # keep placeholders for partition and incremental conditions
+                        if partition_column:
+                            placeholders['partition'] = '{partition}'
+                        if incremental:
+                            placeholders['incremental'] = '{incremental}'
+                        source_query = get_query(extract, {**extra_args, **placeholders}) if placeholders else get_query(extract, extra_args)
+                        if incremental: # only rows after watermark of previous load
+                            incremental_key = watermark_key(options.source, extract, incremental, options.target, options.load)
+                            watermark = get_watermark(incremental_key)
+                            log.info(f'incremental extract by <{incremental}> after <{watermark}>')
+                            source_query = incremental_query(source_query, incremental, watermark)
+                        if extract_params.get('chunksize'): # stream result by chunks
+                            log.info(f"streaming data by chunks of {extract_params['chunksize']} rows")
+                        cached = None
+                        if options.cache: # local cache of query results
+                            key = cache_key(source, source_query, extra_args)
+                            if not options.cache_refresh:
+                                cached = cache_read(key, options.cache_ttl, extract_params.get('chunksize'), extract_engine == 'arrow')
+                        if cached is not None:
+                            dataset = cached
+                        elif partition_column:
+                            log.info(f'extracting data in {partitions} parallel partitions by <{partition_column}>')
+                            dataset = read_sql_partitions(source_query, source_engine, partition_column, partitions, 
+                                                          extract_engine=extract_engine, **extract_params)
+                        elif extract_engine == 'arrow':
+                            log.debug('extracting data with arrow engine')
+                            dataset = read_sql_arrow(source_query, source_engine, **extract_params)
+                        elif extract_params.get('chunksize'):
+                            dataset = read_sql_chunks(source_query, source_engine, **extract_params)
+                        else:
+                            dataset = pd.read_sql(sql=source_query, con=source_engine, **extract_params)
+                        if options.cache and cached is None:
+                            dataset = cache_write(dataset, key, options.cache_size * 1024**2)
+                        if incremental: # max value is saved as watermark after load
+                            watermark_state = {}
+                            watermark_column = incremental.split('.')[-1].strip('"`[]')
+                            dataset = track_max(iter_chunks(dataset), watermark_column, watermark_state)
+                            if extract_params.get('chunksize') is None and not partition_column:
+                                dataset = collect_chunks(dataset)
                 except Exception as e:
                         log.error(e)
                         sys.exit(1)
     else:
         log.info(f'extracting data from stdin')
-        dataset = pd.read_csv(sys.stdin, sep=';', header=0)
+        dataset = read_csv_source('-', sep=';', header=0)
+    incremental_state = (incremental_key, options.extract, incremental, watermark_state) if incremental else None
+    return dataset, incremental_state
 
-    if not options.execute:
-        log.info(dataframe_size_info(dataset))
+def extract_inputs(options, extra_args, transform_connection):
+    """
+    Extract named sources at the same time and register them as tables of transform
+    connection, without transform dataframes of sources are returned with watermarks
+    of incremental extracts
 
-    # check if dataset is empty
-    if options.extract and dataset.empty:
-        log.warning("no data received, exiting without updating target")
-        return sys.exit(0)
+    """
+    def extract_input(name, source, extract):
+        log.info(f'extracting source <{name}>')
+        input_options = type('OptionValuesClass', (options,), {'source': source, 'extract': extract, 'execute': '', 'inputs': None})
+        connection = transform_connection.cursor() if transform_connection is not None else None # cursor per thread
+        return extract_dataset(input_options, extra_args, connection)
 
-    if options.transform:
-        import duckdb
-        log.info(f'transforming data with <{options.transform}>')
-        trasform_query = str(get_query(options.transform, extra_args))
-        try:
-            duckdb.register('dataset', dataset)
-            dataset = duckdb.sql(trasform_query).df()
-        except Exception as e:
-            log.error(e)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(options.inputs)) as executor:
+        futures = {name: executor.submit(extract_input, name, source, extract)
+                   for name, (source, extract) in options.inputs.items()}
+    datasets, watermarks = {}, []
+    for name, future in futures.items():
+        dataset, incremental_state = future.result()
+        if is_relation(dataset): # file is read by transform query
+            dataset.create_view(name)
+        elif dataset is not None:
+            dataset = collect_chunks(dataset)
+            log.info(f'<{name}>: {dataframe_size_info(dataset)}')
+            if transform_connection is not None:
+                transform_connection.register(name, dataset)
+            else:
+                datasets[name] = dataset
+        if incremental_state:
+            watermarks.append(incremental_state)
+    return datasets, watermarks
+
+def run_job(options, extra_args):
+    """
+    Run one extract, transform, load job described by options
+
+    """
+# check options
+    if options.extract and options.execute:
+        log.error("options --extract and --execute are mutually exclusive")
+        sys.exit(1)
+
+    transform_connection = None
+    if options.transform: # files of source are scanned by this connection directly
+        transform, transform_params = options.transform, {}
+        if '??' in transform: # take settings for duckdb
+            transform, transform_params = transform.split('??', 1)
+            transform_params = parse_url_params(transform_params)
+        transform_chunksize = transform_params.pop('chunksize', None)
+        transform_connection = transform_connect(**transform_params)
+
+# extract dataset from source
+    sheets = None # several datasets for sheets of excel target
+    if options.inputs: # named sources are tables of transform query or sheets of excel target
+        excel_target = (options.target or '').split('??', 1)[0].endswith(('.xlsx', '.xls'))
+        if not options.transform and not excel_target:
+            log.error("named sources can be used only with --transform or excel target")
             sys.exit(1)
+        dataset = None
+        with stage('extract'):
+            datasets, watermarks = extract_inputs(options, extra_args, transform_connection)
+        if not options.transform:
+            sheets = datasets
+    else:
+        with stage('extract'): # streamed query results are fetched later by chunks
+            dataset, incremental_state = extract_dataset(options, extra_args, transform_connection)
+        watermarks = [incremental_state] if incremental_state else []
+        if dataset is None: # nothing extracted, query was only executed
+            return
+
+        if is_relation(dataset): # file is read by transform query
+            dataset_empty = False
+        elif not isinstance(dataset, pd.DataFrame): # streamed dataset
+            chunks = metered(dataset, 'fetch', first='query')
+            first_chunk = next(chunks, None)
+            if first_chunk is None:
+                first_chunk = pd.DataFrame()
+            dataset = log_chunks(itertools.chain([first_chunk], chunks))
+            dataset_empty = first_chunk.empty
+        else:
+            if not options.execute:
+                log.info(dataframe_size_info(dataset))
+            count_rows('extract', dataset)
+            dataset_empty = dataset.empty
+
+        # check if dataset is empty
+        if options.extract and dataset_empty:
+            log.warning("no data received, exiting without updating target")
+            return sys.exit(0)
+
+    saved = False
+    if options.transform:
+        log.info(f'transforming data with <{transform}>')
+        trasform_query = get_query(transform, extra_args, bind=False)
+        with stage('transform'):
+            try:
+                if dataset is None: # named sources are registered already
+                    arrow_result = True
+                elif is_relation(dataset):
+                    dataset.create_view('dataset')
+                    arrow_result = True
+                else:
+                    dataset = collect_chunks(dataset)
+                    transform_connection.register('dataset', dataset)
+                    arrow_result = is_arrow_backed(dataset) # keep arrow arrays without converting to numpy
+                copy = None
+                if options.target: # csv and parquet targets are written by duckdb without dataframe
+                    target, _, target_params = options.target.partition('??')
+                    copy = copy_options(target, parse_url_params(target_params))
+                if copy:
+                    create_dir(target)
+                    target_path = target.replace("'", "''")
+                    transform_connection.sql(trasform_query).create_view('etl_transform') # query may end with ; or comment
+                    transform_connection.execute(f"copy etl_transform to '{target_path}' ({copy})")
+                    log.info(f'data saved to file <{target}>')
+                    saved = True
+                elif transform_chunksize:
+                    log.info(f'streaming data by chunks of {transform_chunksize} rows')
+                    dataset = log_chunks(metered(duckdb_chunks(transform_connection.execute(trasform_query), transform_chunksize), 'transform'))
+                elif arrow_result:
+                    result = transform_connection.sql(trasform_query)
+                    table = result.to_arrow_table() if hasattr(result, 'to_arrow_table') else result.arrow()
+                    dataset = arrow_to_pandas(table)
+                else:
+                    dataset = transform_connection.sql(trasform_query).df()
+                count_rows('transform', dataset if isinstance(dataset, pd.DataFrame) else None)
+            except Exception as e:
+                log.error(e)
+                sys.exit(1)
 
-    # load dataset to target
-    if options.target:
+    if options.optimize_dtypes and not saved and dataset is not None: # smaller dataframe for writers
+        with stage('optimize'):
+            dataset = optimize_dtypes(dataset, numeric=not options.load) # int8 would make smallint column of new table
+
+    # load dataset to target, streamed chunks are fetched while loading
+    stage_begin('load')
+    if dataset is not None and not isinstance(dataset, pd.DataFrame) and not is_relation(dataset):
+        dataset = fetched(dataset)
+    dataset = count_rows('load', dataset)
+    if options.target and not saved:
         target_params = {}
         if '??' in options.target: # take parameters for sqlalchemy engine
             target, target_params = options.target.split('??', 1)
@@ -506,31 +2477,43 @@ def cli(ctx, **kwargs):
             target_params.setdefault('sep',';') # default params
             target_params.setdefault('encoding','utf-8')
             target_params.setdefault('index',False)
-            if target.endswith('.csv.zip'):
-                target_params.setdefault('compression','zip')
+            if target.endswith('.csv.zip'): # member is named by target, not by temporary file
+                target_params.setdefault('compression', {'method': 'zip', 'archive_name': os.path.basename(target)[:-len('.zip')]})
             try: # load data
                 log.debug(f'target params: {target_params}')
-                dataset.to_csv(target, **target_params)
+                with atomic_path(target) as temp_path:
+                    if isinstance(dataset, pd.DataFrame):
+                        dataset.to_csv(temp_path, **target_params)
+                    else:
+                        write_csv_chunks(dataset, temp_path, **target_params)
                 log.info(f'data saved to file <{target}>')
+                saved = True
             except Exception as e:
                 log.error(e)
         # load to xlsx
         elif target.endswith('.xlsx') or target.endswith('.xls'):
             create_dir(target) # manage folders if not exist
-            target_params.setdefault('engine','openpyxl')
-            target_params.setdefault('if_sheet_exists','replace')
             log.debug(f'target params: {target_params}')
             sheet_name = target_params.pop('sheet_name', 'data')
+            if sheets is None:
+                sheets = {sheet_name: dataset}
             if os.path.exists(target):
                 mode = target_params.pop('mode', 'a') # read file mode or append by default
             else:    
                 mode='w' #create new file mode
-            if mode == 'w': #if_sheet_exists is valid only when append mode
-                target_params.pop('if_sheet_exists', None)
             try: # load data
-                with pd.ExcelWriter(target, mode=mode, **target_params) as writer:
-                    dataset.to_excel(writer, sheet_name=sheet_name, index=False) 
-                log.info(f'data saved to file <{target}> on sheet <{sheet_name}>')
+                with atomic_path(target) as temp_path:
+                    if mode == 'w': # new workbook is written in one pass
+                        write_workbook(temp_path, sheets, target_params.get('engine'))
+                    else: # workbook is rewritten once for all sheets, other sheets are kept
+                        shutil.copyfile(target, temp_path)
+                        target_params.setdefault('engine','openpyxl')
+                        target_params.setdefault('if_sheet_exists','replace')
+                        with pd.ExcelWriter(temp_path, mode=mode, **target_params) as writer:
+                            for name, sheet in sheets.items():
+                                collect_chunks(sheet).to_excel(writer, sheet_name=name, index=False)
+                log.info(f'data saved to file <{target}> on sheet <{", ".join(sheets)}>')
+                saved = True
             except Exception as e:
                 log.error(e)
         # load to parquet
@@ -538,35 +2521,52 @@ def cli(ctx, **kwargs):
             create_dir(target) # manage folders if not exist
             target_params.setdefault('index',False)
             try: # load data
-                dataset.to_parquet(target, **target_params)
+                if 'partition_cols' in target_params: # folder of files is added to
+                    collect_chunks(dataset).to_parquet(target, **target_params)
+                else:
+                    with atomic_path(target) as temp_path:
+                        if isinstance(dataset, pd.DataFrame):
+                            dataset.to_parquet(temp_path, **target_params)
+                        else:
+                            write_parquet_chunks(dataset, temp_path, **target_params)
                 log.info(f'data saved to file <{target}>')
+                saved = True
             except Exception as e:
                 log.error(e)
         # load to xml
         elif target.endswith('.xml'):
             create_dir(target) # manage folders if not exist
+            dataset = collect_chunks(dataset)
             target_params.setdefault('index',False)
             try: # load data
-                dataset.to_xml(target, **target_params)
+                with atomic_path(target) as temp_path:
+                    dataset.to_xml(temp_path, **target_params)
                 log.info(f'data saved to file <{target}>')
+                saved = True
             except Exception as e:
                 log.error(e)
         # load to html
         elif target.endswith('.html'):
             create_dir(target) # manage folders if not exist
+            dataset = collect_chunks(dataset)
             target_params.setdefault('index',False)
             try: # load data
-                dataset.to_html(target, **target_params)
+                with atomic_path(target) as temp_path:
+                    dataset.to_html(temp_path, **target_params)
                 log.info(f'data saved to file <{target}>')
+                saved = True
             except Exception as e:
                 log.error(e)
         # load to json
         elif target.endswith('.json'):
             create_dir(target) # manage folders if not exist
+            dataset = collect_chunks(dataset)
             target_params.setdefault('index',False)
             try: # load data
-                dataset.to_json(target, **target_params)
+                with atomic_path(target) as temp_path:
+                    dataset.to_json(temp_path, **target_params)
                 log.info(f'data saved to file <{target}>')
+                saved = True
             except Exception as e:
                 log.error(e)
         # load to sources with connection strings
@@ -578,6 +2578,8 @@ def cli(ctx, **kwargs):
                 target_params = parse_url_params(target_params)
             if any(s in target for s in special_sources): # any custom sources and apies
                 log.debug(f'target params: {target_params}')
+                if 'bigquery://' not in target: # bigquery loads chunks as row groups of one file
+                    dataset = collect_chunks(dataset)
                 # load to google sheets
                 if 'google+sheets' in target:
                     if dataset.size <= 10000000:
@@ -593,67 +2595,34 @@ def cli(ctx, **kwargs):
                             log.info(f'new sheet added <{sheet_name}>')
                         except Exception as e:
                             log.error(e)
-                        for col in dataset.columns:
-                            if pd.api.types.is_numeric_dtype(dataset[col]):
-                                dataset[col] = dataset[col].fillna(0)
-                            else:
-                                try:
-                                    dataset[col] = dataset[col].fillna('')
-                                except ValueError:
-                                    dataset[col] = dataset[col].astype(object).fillna('')
-                        sheet.set_dataframe(dataset, start="A1", fit=True, nan='', include_tailing_empty=False)
+                        gsheet_write(sheet, dataset, target_params.get('block_rows'),
+                                     target_params.get('concurrency', 4), target_params.get('retries', 5))
                         log.info(f'data saved to spreadsheet <{workbook_ref}!{sheet_name}>')
+                        saved = True
                     else:
                         log.error('saving to gsheet is ommited due to limit 10M of cells')
                         sys.exit(1)
                 # load to microsoft 365 excel
                 if 'microsoft+graph' in target:
-                    if dataset.size <= 5000000:
+                    if len(dataset) < 1048576: # rows limit of excel sheet
                         token_response, cfg = msgraph_open(target_params.get('credentials'))
                         log.debug(token_response)
-                        urllib = __import__('urllib')
-                        requests = __import__('requests')
-                        # access_token = token_response['access_token']
                         workbook_url = options.load
                         sheet_name = 'data'
                         if '??' in options.load:
                             workbook_url, sheet_name = options.load.split('??', 1)
                             sheet_name = parse_url_params(sheet_name)
                             sheet_name = sheet_name.pop('sheet_name', 'data')
-                        url = workbook_url + f"/workbook/worksheets"
-                        # try to add worksheet
-                        response = api_call(requests.post, url, {"name": f"{sheet_name}"}, resource=cfg['resource'], access_token=token_response['access_token'])
-                        if response.status_code == 201:
-                            logging.info(f'New sheet <{sheet_name}> added')
-                        # clear all worksheet range
-                        url = workbook_url + f"/workbook/worksheets/{sheet_name}/range(address='A:XFD')/clear"
-                        response = api_call(requests.post, url, {"applyTo": "All"}, resource=cfg['resource'], access_token=token_response['access_token'])
-                        logging.debug(response)
-                        # add new table
-                        url = workbook_url + f"/workbook/worksheets/{sheet_name}/tables/add"
-                        col_range = 'A1:%s1' % colnum_string(len(dataset.columns))
-                        response = api_call(requests.post, url, {"address": f"{col_range}","hasHeaders": True, "name": sheet_name}, resource=cfg['resource'], access_token=token_response['access_token']).json()
-                        table_id = response.get('id')
-                        if response.get('error'):
-                            logging.error(f"{response['error']['code']}: {response['error']['message']}")
+                        try:
+                            msgraph_upload(workbook_url, sheet_name, dataset, cfg['resource'], token_response['access_token'],
+                                           target_params.get('concurrency', 4), target_params.get('retries', 5))
+                            log.info(f'data saved to <{workbook_url}> on sheet <{sheet_name}>')
+                            saved = True
+                        except Exception as e:
+                            log.error(e)
                             sys.exit(1)
-                        # add table header
-                        url = workbook_url + f"/workbook/worksheets/{sheet_name}/range(address='{col_range}')"
-                        body = {'values': [dataset.to_dict(orient='split')['columns']]}
-                        response = api_call(requests.patch, url, body, resource=cfg['resource'], access_token=token_response['access_token'])
-                        dataset = dataset.fillna('')
-                        # add rows by chanks
-                        chunksize = 1000
-                        for g, df in dataset.groupby(np.arange(len(dataset)) // chunksize):
-                            url = workbook_url + f"/workbook/tables/{table_id}/Rows"
-                            data_dictionary = df.to_dict(orient='split')['data']
-                            data_body = json.dumps(data_dictionary, default=str) # to awoid TypeError: Object of type date is not JSON serializable
-                            body={'values': json.loads(data_body)}
-                            response = api_call(requests.post, url, body, resource=cfg['resource'], access_token=token_response['access_token'])
-                        if response.status_code == 201:
-                            logging.info(f'Saved data to <{workbook_url}> on <{sheet_name}> sheet')
                     else:
-                        log.error('saving to graph api is ommited due to limit 5M of cells')
+                        log.error('saving to graph api is ommited due to limit 1048576 rows of excel sheet')
                         sys.exit(1)
                 # load to bigquery
                 if 'bigquery://' in target:
@@ -665,14 +2634,7 @@ def cli(ctx, **kwargs):
                             load, load_params = load.split('??', 1)
                         if load_params:
                             load_params = parse_url_params(load_params)
-                        load_params.setdefault('if_exists', 'append')
-                        if target_params.get('credentials_path'):
-                            service_account = __import__('google.oauth2.service_account', fromlist=['Credentials'])
-                            credentials_path = os.path.expanduser(target_params['credentials_path'])
-                            load_params['credentials'] = service_account.Credentials.from_service_account_file(
-                                credentials_path,
-                                scopes=['https://www.googleapis.com/auth/bigquery'],
-                            )
+                        if_exists = load_params.pop('if_exists', 'append')
                         if '.' in load:
                             schema, table = load.split('.')
                         else:
@@ -682,28 +2644,18 @@ def cli(ctx, **kwargs):
                         full_table_id = f"{schema}.{table}" if schema else table
                         log.debug(f'load params: {load_params}')
                         try:
-                            pandas_gbq = __import__('pandas_gbq')
-                            pandas_gbq.to_gbq(
-                                dataset,
-                                destination_table=full_table_id,
-                                project_id=project_id,
-                                progress_bar=False,
-                                **load_params,
-                            )
-                            log.info(f'data saved to <{options.target}> in table <{options.load}>')
+                            client, _ = bigquery_client(project_id, target_params.get('credentials_path'), target_params.get('emulator'))
+                            rows = bigquery_load(client, dataset, full_table_id, if_exists, **load_params)
+                            log.info(f'data saved to <{options.target}> in table <{options.load}>, {rows} rows')
+                            saved = True
                         except Exception as e:
                             log.error(e)
             # any sql sources supported by sqlalchemy or its extentions
             else: 
                 target_params.setdefault('max_identifier_length', 128) # default params
-                engine = sqlalchemy.create_engine(target, poolclass=NullPool, **target_params)
- 
-                @sqlalchemy.event.listens_for(engine, "do_setinputsizes")
-                # The CLOB datatype in cx_Oracle incurs a significant performance overhead
-                def _remove_clob(inputsizes, cursor, statement, parameters, context):
-                    for bindparam, dbapitype in list(inputsizes.items()):
-                        if dbapitype is sqlalchemy.CLOB:
-                            del inputsizes[bindparam]
+                engine = get_engine(target, poolclass=sqlalchemy.pool.NullPool, **target_params)
+                if not sqlalchemy.event.contains(engine, "do_setinputsizes", remove_clob):
+                    sqlalchemy.event.listen(engine, "do_setinputsizes", remove_clob)
 
                 if options.load:
                     load_params = {}
@@ -714,22 +2666,417 @@ def cli(ctx, **kwargs):
                         load_params = parse_url_params(load_params)
                     load_params.setdefault('if_exists','append')
                     load_params.setdefault('index',False)
+                    try: # native column types for every chunk instead of inferred by pandas
+                        if options.schema == 'infer':
+                            chunks = iter_chunks(dataset)
+                            first_chunk = next(chunks)
+                            dataset = itertools.chain([first_chunk], chunks)
+                            load_params['dtype'] = infer_schema(first_chunk)
+                        elif options.schema:
+                            load_params['dtype'] = read_schema(options.schema, engine.dialect)
+                            dataset = conform_chunks(iter_chunks(dataset), load_params['dtype'])
+                    except Exception as e:
+                        log.error(e)
+                        sys.exit(1)
+                    if load_params.get('method', 'bulk') == 'bulk': # native bulk protocol of dialect if known
+                        load_params['method'] = get_bulk_method(engine)
                     log.debug(f'load params: {load_params}')
                     if '.' in load:
                         schema, table  = load.split('.')
                     else:
                         table = load
                         schema = None
+                    atomic = load_params.pop('atomic', True)
                     try:
-                        dataset.to_sql(name=table, schema=schema, con=engine, **load_params)
+                        if load_params['if_exists'] == 'upsert': # merge by key columns through staging table
+                            keys = load_params.pop('key', None)
+                            if not keys:
+                                raise ValueError('upsert needs key columns, e.g. ??if_exists=upsert&key=id,dt')
+                            rows = upsert_load(dataset, engine, table, schema, keys, **load_params)
+                            if rows is not None and rows >= 0:
+                                log.info(f'{rows} rows inserted or updated')
+                        elif load_params['if_exists'] == 'replace' and atomic: # swap with shadow table
+                            replace_load(dataset, engine, table, schema, **load_params)
+                        else:
+                            for i, chunk in enumerate(iter_chunks(dataset)):
+                                if i: # next chunks are appended to the table created by the first one
+                                    load_params['if_exists'] = 'append'
+                                chunk.to_sql(name=table, schema=schema, con=engine, **load_params)
                         log.info(f'data saved to <{options.target}> in table <{options.load}>')
+                        saved = True
                     except Exception as e:
                         log.error(e)
-    elif not options.execute:
+    elif not options.target and not options.execute:
         log.info(f'loading data to stdout')
-        dataset.to_csv(sys.stdout, sep=';', header=True, index=False)
+        for i, chunk in enumerate(iter_chunks(dataset)):
+            chunk.to_csv(sys.stdout, sep=';', header=(i == 0), index=False)
+        saved = True
+    stage_end('load')
+
+    # move watermarks only after data was loaded
+    for key, extract, column, state in watermarks:
+        if saved and state.get('value') is not None:
+            set_watermark(key, extract, column, state['value'])
+
+def named_inputs(sources, extracts):
+    """
+    Split repeated --source and --extract options of name=value form to named inputs,
+    single source without name works as usual
+
+    """
+    pattern = re.compile(r'^([A-Za-z_]\w*)=(.+)$', re.S) # name before = is identifier unlike urls and queries
+    named_sources = dict(pattern.match(s).groups() for s in sources if pattern.match(s))
+    if not named_sources:
+        if len(sources) > 1 or len(extracts) > 1:
+            raise ValueError('several sources or queries need names, e.g. --source facts=db1 --extract facts=query.sql')
+        return (sources[0] if sources else None), (extracts[0] if extracts else ''), None
+    if len(named_sources) < len(sources):
+        raise ValueError('all sources need names when several sources are used')
+    named_extracts = {}
+    for extract in extracts:
+        match = pattern.match(extract)
+        if not match or match.group(1) not in named_sources:
+            raise ValueError(f'query <{extract}> is not bound to any named source')
+        named_extracts[match.group(1)] = match.group(2)
+    return None, '', {name: (source, named_extracts.get(name, '')) for name, source in named_sources.items()}
+
+def timed_job(name, options, extra_args):
+    """
+    Run job and return its name, status and duration in seconds
+
+    """
+    threading.current_thread().name = name
+    started = time.perf_counter()
+    try:
+        with measured_job(name, options):
+            run_job(options, extra_args)
+        status = 'ok'
+    except SystemExit as e: # jobs exit on errors like a command does
+        status = 'failed' if e.code else 'ok'
+    except Exception as e:
+        log.error(e)
+        status = 'failed'
+    return name, status, time.perf_counter() - started
+
+def run_manifest(manifest_path, options, extra_args):
+    """
+    Run jobs from manifest file in one process, engines and credentials are shared by jobs
+
+    """
+    global keep_engines
+    keep_engines = True
+    job_keys = ('source', 'extract', 'execute', 'transform', 'target', 'load', 'inputs', 'optimize_dtypes', 'schema')
+    manifest_path = os.path.expanduser(manifest_path)
+    if not os.path.isfile(manifest_path):
+        log.error(f'manifest file not found <{manifest_path}>')
+        sys.exit(1)
+    with open(manifest_path, 'r') as manifest_file:
+        manifest = yaml.safe_load(manifest_file) or {}
+    if isinstance(manifest, list): # only list of jobs
+        manifest = {'jobs': manifest}
+    concurrency = options.concurrency or manifest.get('concurrency', 1)
+    manifest_args = {**manifest.get('args', {}), **extra_args}
+    defaults = {key: getattr(options, key) for key in dir(options) if not key.startswith('__')}
+    defaults.update(source=None, extract='', execute='', transform='', target=None, load='', inputs=None, manifest='')
+
+    for handler in logging.getLogger().handlers: # job name in log lines
+        handler.setFormatter(logging.Formatter('%(asctime)s | %(levelname)-5s | %(process)d | %(threadName)s | %(message)s', datefmt='%Y-%m-%d %H:%M:%S'))
+    log.info(f'running {len(manifest.get("jobs", []))} jobs from <{manifest_path}> with concurrency {concurrency}')
+
+    futures = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for i, job in enumerate(manifest.get('jobs', []), 1):
+            unknown = set(job) - set(job_keys) - {'name', 'args', 'wait'}
+            if unknown:
+                log.error(f'unknown keys in job {i}: {sorted(unknown)}')
+                sys.exit(1)
+            if job.get('wait'): # like bash wait, previous jobs have to finish
+                concurrent.futures.wait(futures)
+            job_values = {k: job[k] for k in job_keys if k in job}
+            if job_values.get('inputs'): # name: source or name: {source: ..., extract: ...}
+                job_values['inputs'] = {
+                    name: (value, '') if isinstance(value, str) else (value['source'], value.get('extract', ''))
+                    for name, value in job_values['inputs'].items()
+                }
+            job_options = type('OptionValuesClass', (), {**defaults, **job_values})
+            job_args = {k: str(v) for k, v in {**manifest_args, **job.get('args', {})}.items()}
+            futures.append(executor.submit(timed_job, str(job.get('name', f'job-{i}')), job_options, job_args))
+    results = [future.result() for future in futures]
+
+    log.info('jobs summary:')
+    for name, status, seconds in results:
+        log.info(f'{name:<30} {status:<6} {seconds:9.2f}s')
+    failed = [name for name, status, _ in results if status != 'ok']
+    if failed:
+        log.error(f'{len(failed)} of {len(results)} jobs failed')
+        sys.exit(1)
+
+def socket_path():
+    default_path = os.path.join(os.environ.get('XDG_RUNTIME_DIR') or cache_dir(), 'etl.sock')
+    return os.path.expanduser(os.environ.get('ETL_SOCKET') or default_path)
+
+def serve_request(path):
+    """
+    Send command line to etl server with stdin, stdout and stderr of this process,
+    returns exit code of job or None if server is not running or runs other job
+
+    """
+    if not hasattr(socket, 'send_fds'): # no descriptor passing on this platform
+        return None
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    with client:
+        try:
+            client.connect(path)
+            request = json.dumps({'argv': sys.argv[1:], 'cwd': os.getcwd(), 'env': dict(os.environ)})
+            socket.send_fds(client, [b'\n'], [0, 1, 2]) # job writes to the same pipes and terminal
+            client.sendall(request.encode() + b'\n')
+        except OSError: # stale socket of stopped server or closed standard stream
+            return None
+        log.debug(f'job is sent to etl server <{path}>')
+        reply = client.makefile('rb').readline()
+    if reply == b'busy\n': # job of other command is running, parallel commands run by themselves
+        log.debug(f'etl server is busy')
+        return None
+    if not reply:
+        log.error(f'etl server <{path}> closed connection before job finished')
+        return 1
+    return int(reply)
+
+def serve_job(request, fds):
+    """
+    Run command line of client in server process with its standard streams,
+    working directory and environment, returns exit code
+
+    """
+    streams = [open(fd, mode, closefd=True) for fd, mode in zip(fds, ('r', 'w', 'w'))]
+    saved = sys.stdin, sys.stdout, sys.stderr, os.getcwd(), dict(os.environ)
+    root = logging.getLogger()
+    handlers, level = root.handlers, root.level
+    handler = logging.StreamHandler(streams[2])
+    handler.setFormatter(logging.Formatter('%(asctime)s | %(levelname)-5s | %(process)d | %(message)s', datefmt='%Y-%m-%d %H:%M:%S'))
+    code = 1
+    try:
+        sys.stdin, sys.stdout, sys.stderr = streams
+        root.handlers = [handler]
+        root.setLevel(logging.INFO)
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['env'])
+        get_config.cache_clear() # config path depends on working directory and environment
+        collected_metrics.clear()
+        cli.main(args=request['argv'], prog_name='etl')
+    except SystemExit as e: # click exits with code of command
+        code = e.code if isinstance(e.code, int) else int(e.code is not None)
+    except Exception as e:
+        root.error(e)
+    finally:
+        with engines_lock: # connections to local database files would lock them for other processes
+            for engine in engines.values():
+                if engine.url.get_backend_name() in ('sqlite', 'duckdb'):
+                    engine.dispose()
+        for stream in streams:
+            try:
+                stream.close()
+            except OSError: # reader of stdout has gone
+                pass
+        sys.stdin, sys.stdout, sys.stderr, cwd, env = saved
+        root.handlers = handlers
+        root.setLevel(level)
+        os.chdir(cwd)
+        os.environ.clear()
+        os.environ.update(env)
+    return code
+
+def serve_connection(connection, request, fds, server_log):
+    """
+    Run job of client connection and send its exit code
+
+    """
+    with connection:
+        started = time.perf_counter()
+        code = serve_job(request, fds)
+        server_log.info(f'job from <{request["cwd"]}> finished with exit code {code} in {time.perf_counter() - started:.2f}s')
+        server_log.debug(f'job command line: {request["argv"]}')
+        try:
+            connection.sendall(f'{code}\n'.encode())
+        except OSError: # client was interrupted
+            pass
+
+def serve(path):
+    """
+    Run etl server on unix socket, jobs of etl commands are run in this process
+    with warm imports and pooled engines shared by jobs with the same connection,
+    commands coming while a job is running are told to run in their own process
+
+    """
+    global serving, keep_engines
+    path = os.path.abspath(path)
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        with probe:
+            try:
+                probe.connect(path)
+            except OSError: # socket of killed server
+                os.remove(path)
+            else:
+                log.error(f'etl server is already running on <{path}>')
+                sys.exit(1)
+    create_dir(path)
+    serving = keep_engines = True
+    for name in ('pandas', 'sqlalchemy', 'pyarrow', 'duckdb'): # imported once instead of every command
+        if importlib.util.find_spec(name):
+            importlib.import_module(name)
+    server_log = logging.getLogger('etl.server') # jobs write root logger to stderr of their clients
+    server_log.handlers, server_log.propagate = list(log.handlers), False
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set()) # running job is finished before exit
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.set())
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o177) # only owner may connect, jobs run with rights of server
+    try:
+        server.bind(path)
+    finally:
+        os.umask(umask)
+    server.listen(16)
+    server.settimeout(1) # stop flag is checked between connections
+    server_log.info(f'etl server is listening on <{path}>')
+    worker = None
+    try:
+        while not stopping.is_set():
+            try:
+                connection, _ = server.accept()
+            except TimeoutError:
+                continue
+            fds = []
+            try:
+                connection.settimeout(10) # client sends request right after connecting
+                _, fds, _, _ = socket.recv_fds(connection, 1, 3)
+                request = json.loads(connection.makefile('rb').readline())
+                connection.settimeout(None)
+                if len(fds) != 3:
+                    raise ValueError(f'expected 3 standard streams, got {len(fds)}')
+                rejected = worker is not None and worker.is_alive()
+                if rejected: # parallel commands of script are not queued behind running job
+                    connection.sendall(b'busy\n')
+            except (OSError, ValueError) as e:
+                server_log.error(f'bad request: {e}')
+                rejected = True
+            if rejected:
+                for fd in fds:
+                    os.close(fd)
+                connection.close()
+                continue
+            worker = threading.Thread(target=serve_connection, args=(connection, request, fds, server_log), name='job')
+            worker.start()
+    finally:
+        if worker is not None: # job changes working directory of process
+            worker.join()
+        server.close()
+        os.remove(path)
+        for engine in engines.values():
+            engine.dispose()
+        server_log.info('etl server stopped')
 
-    log.debug(f"memory usage (rss): {psutil.Process().memory_info().rss / 1024**2:.2f} MB")
+@cli.command(context_settings=dict(ignore_unknown_options=True, allow_extra_args=True))
+@cli.version_option(package_name="etl")
+@cli.pass_context
+@cli.option('--source', required=False, type=str, multiple=True, help="Source for extracting data. Database name, csv or xls filename. Defaults to stdin if not provided. Repeat as name=source for several sources of --transform.")
+@cli.option('--extract', type=str, multiple=True, help="Sql file name for extracting data from database. Repeat as name=query for named sources.")
+@cli.option('--execute', default='', help="Sql file name for executing without extracting data")
+@cli.option('--transform', default='', help="Sql file name for transforming data in extracted dataset")
+@cli.option('--target', required=False, type=str, help="Target for inserting data. Database name, csv or xls filename. Defaults to stdout if not provided.")
+@cli.option('--load', default='', help="Database schema and table name, if target is database")
+@cli.option('--schema', default='', help="Yaml file with column types of sql target table, or infer to size varchar columns by first chunk")
+@cli.option('--optimize-dtypes', default=False, is_flag=True, help="Convert columns to smaller dtypes before loading and report memory saved")
+@cli.option('--config-path', default='', help="Custom path to etl.yml config")
+@cli.option('--list', default=False, is_flag=True, help="List named connections from etl.yml and exit.")
+@cli.option('--manifest', default='', help="Yaml file with list of jobs to run in one process")
+@cli.option('--concurrency', default=None, type=int, help="Number of manifest jobs running at the same time")
+@cli.option('--serve', default=False, is_flag=True, help="Run etl server on unix socket keeping warm imports and pooled connections, next etl commands send jobs to it")
+@cli.option('--cache/--no-cache', default=False, envvar='ETL_CACHE', help="Keep query results in local cache and reuse them")
+@cli.option('--cache-refresh', default=False, is_flag=True, help="Run query and replace result in local cache")
+@cli.option('--cache-ttl', default=86400, type=int, envvar='ETL_CACHE_TTL', help="Seconds cached query result is valid")
+@cli.option('--cache-size', default=1024, type=int, envvar='ETL_CACHE_SIZE', help="Max size of local cache in MiB")
+@cli.option('--profile', default=False, is_flag=True, help="Log duration, rows/s, bytes/s and peak rss of job stages")
+@cli.option('--profile-stage', default='', help="Run cProfile and tracemalloc for stage: extract, query, fetch, transform, optimize, load")
+@cli.option('--metrics-file', default='', envvar='ETL_METRICS_FILE', help="Save metrics of job stages to json file or prometheus textfile (.prom)")
+@cli.option('--debug', default=False, is_flag=True, help="Extended level of logging with more info")
+def cli(ctx, **kwargs):
+    global log
+    global options
+    global extra_args
+# logging basic setup
+    log_level = logging.INFO
+    logging.basicConfig(level=log_level, format='%(asctime)s | %(levelname)-5s | %(process)d | %(message)s', datefmt='%Y-%m-%d %H:%M:%S', stream=sys.stderr)
+    log = logging.getLogger()
+
+    class StripCarriageReturnFilter(logging.Filter):
+        def filter(self, record):
+            if isinstance(record.msg, str):
+                record.msg = record.msg.lstrip('\r')
+            return True
+
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(StripCarriageReturnFilter())
+
+# read cli options and extra args
+    try:
+        params = dict(ctx.params)
+        params['source'], params['extract'], params['inputs'] = named_inputs(params['source'], params['extract'])
+        options = type('OptionValuesClass', (), params)
+        extra_args = {ctx.args[i][2:]: ctx.args[i+1] for i in range(0, len(ctx.args), 2)}
+    # except TypeError:
+        # sys.exit(1) # only --help option rise typeError: cannot unpack non-iterable int object
+    except Exception as e:
+        log.error(e)
+        sys.exit(1)
+    if options.debug:
+        log.setLevel(logging.DEBUG)
+
+    log.debug(f'project dir <{os.getcwd()}>')
+
+# print cli option in debug mode
+    if options.debug:
+        option_list = [option for option in dir(options) if not option.startswith("__")]
+        o = {}
+        for i in option_list:
+            value = getattr(options,i)
+            if value:
+                o[i] = getattr(options,i)
+        log.debug(f'command options: {o}')
+        if extra_args:
+            log.debug(f'custom params for query: {extra_args}')
+    else: # same as urllib3.disable_warnings(InsecureRequestWarning) without importing urllib3
+        warnings.filterwarnings('ignore', message='Unverified HTTPS request')
+
+    if options.list:
+        for alias in get_config():
+            print(alias)
+        return
+
+    if options.serve:
+        serve(socket_path())
+        return
+    if not serving and os.path.exists(socket_path()): # run by etl server if it is running
+        code = serve_request(socket_path())
+        if code is not None:
+            sys.exit(code)
+        log.debug(f'job is run in this process')
+
+    try:
+        if options.manifest:
+            run_manifest(options.manifest, options, extra_args)
+        else:
+            with measured_job((options.load or options.target or 'stdout').split('??', 1)[0], options):
+                run_job(options, extra_args)
+    finally: # metrics are saved for failed jobs too
+        if options.metrics_file and collected_metrics:
+            write_metrics(options.metrics_file, collected_metrics)
+
+    if options.debug:
+        log.debug(f"memory usage (rss): {psutil.Process().memory_info().rss / 1024**2:.2f} MB")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""
+Benchmark of etl extract, transform and load paths
+
+Generates synthetic datasets (narrow/wide, numeric/string-heavy) and runs etl
+for every pair of offline source and target in fresh processes, printing median
+wall time, rows/s, MiB/s of source data and peak rss of etl process:
+
+    python3 test/bench_pipeline.py --rows 10000,1000000 --shapes narrow,wide --kinds numeric,strings
+
+Results can be saved as baseline and later runs compared with it, exit code is 1
+if some pair became slower or takes more memory than tolerance allows:
+
+    python3 test/bench_pipeline.py --save-baseline bench.json
+    python3 test/bench_pipeline.py --baseline bench.json --tolerance 0.25
+
+Several etl.py files can be passed to compare versions like in bench_startup.py.
+Generated data is kept in --workdir to be reused by next runs.
+
+"""
+
+import os, sys
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import zipfile
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+chunk_rows = 100000
+excel_rows = 1000000 # sheet limit is 1048576 rows
+document_rows = 1000000 # json and xml are read and written as whole documents
+
+# format: modules needed by etl to read and write it
+formats = {
+    'csv': [],
+    'csv.zip': [],
+    'xlsx': ['openpyxl'],
+    'parquet': ['pyarrow'],
+    'json': [],
+    'xml': ['lxml'],
+    'sqlite': [],
+    'duckdb': ['duckdb', 'duckdb_engine'],
+    'stdin': [],
+}
+targets = ['csv', 'csv.zip', 'xlsx', 'parquet', 'json', 'xml', 'sqlite', 'duckdb', 'stdout', 'transform']
+
+
+def available(name):
+    return all(importlib.util.find_spec(module) for module in formats.get(name, []))
+
+
+def make_chunks(rows, shape, kind, seed=42):
+    """
+    Reproducible chunks of synthetic dataset, string-heavy kind has low and
+    high cardinality strings and iso dates, numeric one has ints and floats
+
+    """
+    import numpy as np
+    import pandas as pd
+    columns = 5 if shape == 'narrow' else 50
+    cities = np.array([f'city_{i}' for i in range(50)])
+    for start in range(0, rows, chunk_rows):
+        size = min(chunk_rows, rows - start)
+        rng = np.random.default_rng(seed + start // chunk_rows)
+        data = {'id': np.arange(start, start + size)}
+        for i in range(1, columns):
+            if kind == 'strings' and i % 3 == 1:
+                data[f'c{i}'] = cities[rng.integers(0, len(cities), size)]
+            elif kind == 'strings' and i % 3 == 2:
+                data[f'c{i}'] = np.char.add('name_', rng.integers(0, 10**9, size).astype(str))
+            elif kind == 'strings':
+                data[f'c{i}'] = (np.datetime64('2024-01-01T00:00:00') + rng.integers(0, 10**8, size).astype('timedelta64[s]')).astype(str)
+            elif i % 2:
+                data[f'c{i}'] = rng.integers(0, 1000, size)
+            else:
+                data[f'c{i}'] = rng.random(size)
+        yield pd.DataFrame(data)
+
+
+def generate(workdir, name, rows, shape, kind, config):
+    """
+    Write dataset in every source format once, existing files are reused
+
+    """
+    import pandas as pd
+    base = os.path.join(workdir, name)
+    marker = base + '.done'
+    if os.path.exists(marker):
+        return
+    print(f'generating {name}', file=sys.stderr)
+    with open(base + '.csv', 'w', newline='') as f:
+        for i, chunk in enumerate(make_chunks(rows, shape, kind)):
+            chunk.to_csv(f, sep=';', header=i == 0, index=False)
+    with zipfile.ZipFile(base + '.csv.zip', 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.write(base + '.csv', os.path.basename(base + '.csv'))
+    if available('parquet'):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        writer = None
+        for chunk in make_chunks(rows, shape, kind):
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            writer = writer or pq.ParquetWriter(base + '.parquet', table.schema)
+            writer.write_table(table)
+        writer.close()
+    if rows <= document_rows:
+        df = pd.concat(make_chunks(rows, shape, kind), ignore_index=True)
+        df.to_json(base + '.json')
+        if available('xml'):
+            df.to_xml(base + '.xml', index=False)
+        if available('xlsx') and rows <= excel_rows:
+            df.to_excel(base + '.xlsx', index=False)
+    import sqlalchemy
+    engine = sqlalchemy.create_engine(config['bench_sqlite'])
+    for i, chunk in enumerate(make_chunks(rows, shape, kind)):
+        chunk.to_sql(name, engine, if_exists='append' if i else 'replace', index=False, chunksize=10000)
+    engine.dispose()
+    if available('duckdb'):
+        import duckdb
+        with duckdb.connect(config['bench_duck'][len('duckdb:///'):]) as connection:
+            connection.execute(f"create or replace table {name} as select * from read_csv('{base}.csv', delim=';', header=true)")
+    open(marker, 'w').close()
+
+
+def command(workdir, name, source, target):
+    """
+    Etl arguments, stdin and stdout files for pair of source and target
+
+    """
+    base = os.path.join(workdir, name)
+    args, stdin, stdout = [], None, None
+    if source == 'sqlite':
+        args += ['--source', 'bench_sqlite', '--extract', f'select * from {name}']
+    elif source == 'duckdb':
+        args += ['--source', 'bench_duck', '--extract', f'select * from {name}']
+    elif source == 'stdin':
+        args += ['--source', '-']
+        stdin = base + '.csv'
+    else:
+        args += ['--source', f'{base}.{source}']
+    output = os.path.join(workdir, 'output', f'{name}-{source}')
+    if target == 'sqlite':
+        args += ['--target', 'bench_sqlite', '--load', f'out_{name}??if_exists=replace']
+    elif target == 'duckdb':
+        args += ['--target', 'bench_duck', '--load', f'out_{name}??if_exists=replace']
+    elif target == 'stdout':
+        stdout = output + '.out'
+    elif target == 'transform':
+        args += ['--transform', 'select * from dataset', '--target', output + '-transform.parquet']
+    else:
+        args += ['--target', f'{output}.{target}']
+    return args, stdin, stdout
+
+
+def source_size(workdir, name, source):
+    path = os.path.join(workdir, name + '.' + {'stdin': 'csv', 'sqlite': 'csv', 'duckdb': 'csv'}.get(source, source))
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def run(etl_path, args, stdin, stdout, env):
+    """
+    Run etl in fresh process, return seconds, peak rss in bytes and exit code
+
+    """
+    with open(stdin or os.devnull, 'rb') as fin, open(stdout or os.devnull, 'wb') as fout, tempfile.TemporaryFile() as ferr:
+        started = time.perf_counter()
+        process = subprocess.Popen([sys.executable, etl_path] + args, stdin=fin, stdout=fout, stderr=ferr, env=env)
+        _, status, usage = os.wait4(process.pid, 0) # rusage of this child only
+        elapsed = time.perf_counter() - started
+        process.returncode = os.waitstatus_to_exitcode(status)
+        if process.returncode:
+            ferr.seek(0)
+            errors = [line for line in ferr.read().decode(errors='replace').splitlines() if 'ERROR' in line]
+            print(f'  {" ".join(args)}: {errors[-1] if errors else "exit code " + str(process.returncode)}', file=sys.stderr)
+    peak = usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    return elapsed, peak, process.returncode
+
+
+def output_rows(path):
+    """
+    Rows of parquet output counted in separate process, pyarrow is not imported here
+
+    """
+    result = subprocess.run([sys.executable, '-c', 'import sys, pyarrow.parquet as pq; print(pq.ParquetFile(sys.argv[1]).metadata.num_rows)', path],
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    return int(result.stdout) if result.returncode == 0 else None
+
+
+def skipped(source, target, rows):
+    for name in (source, target):
+        if not available(name):
+            return f'{name} needs {",".join(formats[name])}'
+        if name in ('json', 'xml') and rows > document_rows:
+            return f'{name} is limited to {document_rows} rows'
+        if name == 'xlsx' and rows > excel_rows:
+            return f'xlsx is limited to {excel_rows} rows'
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='*', default=[os.path.join(os.path.dirname(script_dir), 'etl.py')])
+    parser.add_argument('--rows', default='100000', help='comma separated row counts, e.g. 10000,1000000,50000000')
+    parser.add_argument('--shapes', default='narrow', help='narrow (5 columns), wide (50 columns)')
+    parser.add_argument('--kinds', default='numeric,strings', help='numeric, strings')
+    parser.add_argument('--sources', default=','.join(formats))
+    parser.add_argument('--targets', default=','.join(targets))
+    parser.add_argument('--runs', type=int, default=1)
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'etl-bench'))
+    parser.add_argument('--baseline', help='json file with results to compare with')
+    parser.add_argument('--save-baseline', help='save results to json file')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative growth of time and memory')
+    opts = parser.parse_args()
+
+    os.makedirs(os.path.join(opts.workdir, 'output'), exist_ok=True)
+    config = {
+        'bench_sqlite': f'sqlite:///{opts.workdir}/bench.db',
+        'bench_duck': f'duckdb:///{opts.workdir}/bench.duckdb',
+    }
+    config_path = os.path.join(opts.workdir, '.etl.yml')
+    with open(config_path, 'w') as f:
+        f.write(''.join(f"{alias}: '{url}'\n" for alias, url in config.items()))
+    env = dict(os.environ, ETL_CONFIG=config_path, ETL_STATE=os.path.join(opts.workdir, 'state.db'), ETL_CACHE='0')
+    env.pop('ETL_METRICS_FILE', None)
+
+    baseline = {}
+    if opts.baseline:
+        with open(opts.baseline) as f:
+            baseline = json.load(f)['results']
+    results, regressions = {}, []
+
+    print(f"{'etl.py':<20} {'dataset':<24} {'source':<8} {'target':<9} {'median s':>9} {'rows/s':>10} {'MiB/s':>7} {'peak MiB':>8}  baseline")
+    for path in opts.paths:
+        for rows in [int(r) for r in opts.rows.split(',')]:
+            for shape in opts.shapes.split(','):
+                for kind in opts.kinds.split(','):
+                    name = f'{shape}_{kind}_{rows}'
+                    # separate process keeps this one small, children inherit its max rss
+                    process = multiprocessing.get_context('spawn').Process(target=generate, args=(opts.workdir, name, rows, shape, kind, config))
+                    process.start()
+                    process.join()
+                    for source in opts.sources.split(','):
+                        for target in opts.targets.split(','):
+                            reason = skipped(source, target, rows)
+                            if reason:
+                                print(f"{path[-20:]:<20} {name:<24} {source:<8} {target:<9} skipped, {reason}")
+                                continue
+                            args, stdin, stdout = command(opts.workdir, name, source, target)
+                            timings, peaks, failed = [], [], False
+                            for _ in range(opts.runs):
+                                elapsed, peak, code = run(path, args, stdin, stdout, env)
+                                timings.append(elapsed)
+                                peaks.append(peak)
+                                failed = failed or bool(code)
+                            if target == 'transform' and not failed: # wrong layout of file may still exit with 0
+                                received = output_rows(args[-1])
+                                if received != rows:
+                                    print(f'  {" ".join(args)}: {received} rows in output instead of {rows}', file=sys.stderr)
+                                    failed = True
+                            seconds, peak = statistics.median(timings), max(peaks)
+                            key = f'{name} {source} {target}'
+                            compared = ''
+                            if failed:
+                                compared = 'failed'
+                            elif key in baseline:
+                                time_ratio = seconds / baseline[key]['seconds']
+                                memory_ratio = peak / baseline[key]['peak_rss']
+                                compared = f'time x{time_ratio:.2f}, memory x{memory_ratio:.2f}'
+                                if time_ratio > 1 + opts.tolerance or memory_ratio > 1 + opts.tolerance:
+                                    compared += ' REGRESSION'
+                                    regressions.append(key)
+                            if not failed:
+                                results[key] = {'seconds': round(seconds, 4), 'peak_rss': peak, 'rows': rows}
+                            mib = source_size(opts.workdir, name, source) / 1024**2
+                            print(f"{path[-20:]:<20} {name:<24} {source:<8} {target:<9} {seconds:>9.2f} {rows / seconds:>10.0f} "
+                                  f"{mib / seconds:>7.1f} {peak / 1024**2:>8.0f}  {compared}", flush=True)
+
+    if opts.save_baseline:
+        with open(opts.save_baseline, 'w') as f:
+            json.dump({'python': platform.python_version(), 'platform': platform.platform(), 'results': results}, f, indent=2)
+    if regressions:
+        print(f'{len(regressions)} regressions over tolerance {opts.tolerance:.0%}', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""
+Cold start benchmark of etl command line
+
+Runs typical short commands in fresh interpreters and prints median wall time
+and heavy modules imported by each command. Several etl.py files can be passed
+to compare versions, e.g. with the one from previous commit:
+
+    git show HEAD~1:etl.py > /tmp/etl_old.py
+    python3 test/bench_startup.py /tmp/etl_old.py etl.py --runs 20
+
+"""
+
+import os, sys
+import argparse
+import statistics
+import subprocess
+import tempfile
+import time
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+heavy_modules = ['pandas', 'numpy', 'sqlalchemy', 'pyarrow', 'duckdb', 'psutil', 'urllib3']
+
+# runs etl.py as __main__ and reports heavy modules left in sys.modules
+probe = '''
+import sys, runpy
+path = sys.argv[1]
+sys.argv = ['etl'] + sys.argv[2:]
+try:
+    runpy.run_path(path, run_name='__main__')
+except SystemExit:
+    pass
+finally:
+    loaded = [m for m in {heavy} if m in sys.modules]
+    sys.stderr.write('heavy modules: ' + ','.join(loaded) + '\\n')
+'''.format(heavy=heavy_modules)
+
+
+def scenarios(workdir):
+    db = os.path.join(workdir, 'bench.db')
+    return {
+        'help': ['--help'],
+        'version': ['--version'],
+        'list': ['--list'],
+        'execute': ['--source', f'sqlite:///{db}', '--execute', 'create table if not exists t (a int)'],
+        'extract': ['--source', f'sqlite:///{db}', '--extract', 'select 1 as a'],
+    }
+
+
+def run(etl_path, args, env):
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', probe, etl_path] + args,
+                            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    elapsed = time.perf_counter() - started
+    modules = ''
+    for line in result.stderr.splitlines():
+        if line.startswith('heavy modules: '):
+            modules = line[len('heavy modules: '):]
+    return elapsed, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='*', default=[os.path.join(os.path.dirname(script_dir), 'etl.py')])
+    parser.add_argument('--runs', type=int, default=10)
+    opts = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        config = os.path.join(workdir, '.etl.yml')
+        with open(config, 'w') as f:
+            f.write(f"local: 'sqlite:///{workdir}/bench.db'\n")
+        env = dict(os.environ, ETL_CONFIG=config)
+
+        print(f"{'etl.py':<30} {'command':<10} {'median ms':>10} {'min ms':>8}  heavy modules")
+        for path in opts.paths:
+            for name, args in scenarios(workdir).items():
+                timings = []
+                for _ in range(opts.runs):
+                    elapsed, modules = run(path, args, env)
+                    timings.append(elapsed * 1000)
+                print(f"{path[-30:]:<30} {name:<10} {statistics.median(timings):>10.0f} {min(timings):>8.0f}  {modules or '-'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,7 @@
+select
+    date '{rep_date}' as rep_date,
+    timestamp '{rep_date} 10:00:00' as rep_time,
+    date '{rep_date}' + interval '{days}' day as next_date,
+    '{rep_date}'::date as cast_date,
+    '{rep_date}' as bound_date
+where '{rep_date}' like '2%'
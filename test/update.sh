@@ -101,3 +101,8 @@ parent_dir=$(dirname $script_dir)
 #cat titanic.csv | python3 $parent_dir/etl.py --target local --load main.titanic
 
 #python3 $parent_dir/etl.py --source local --execute "truncate table main.titanic"
+
+#python3 $parent_dir/etl.py --source 'duckdb:///local.duckdb' \
+#                           --extract sql/typed_literals.sql \
+#                           --rep_date 2026-06-01 --days 3 \
+#                           --debug